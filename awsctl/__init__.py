@@ -0,0 +1,5 @@
+#
+# Purpose :     Shared helpers for the aws-boto3-scripts tools
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3, Aws cli
+#
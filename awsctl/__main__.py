@@ -0,0 +1,11 @@
+#
+# Purpose :     Run the awsctl command line with python3 -m awsctl
+# Author:       Ivan Martinez
+# Dependencies: python3
+#
+
+import sys
+
+from awsctl.cli import main
+
+sys.exit(main())
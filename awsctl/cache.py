@@ -0,0 +1,58 @@
+#
+# Purpose :     Small on-disk JSON cache shared by the scripts
+# Author:       Ivan Martinez
+# Dependencies: python3
+#
+
+import json
+import logging
+import os
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'awsctl')
+
+
+## directory holding the cache files, AWSCTL_CACHE_DIR overrides the default
+def cacheDir():
+    directory = os.environ.get('AWSCTL_CACHE_DIR', DEFAULT_CACHE_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def cachePath(name):
+    return os.path.join(cacheDir(), name)
+
+
+## read a cached json document, returns None when missing, corrupt or older than ttl seconds
+def readCache(name, ttl=None):
+    path = cachePath(name)
+    try:
+        if ttl is not None and time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path) as cachefile:
+            return json.load(cachefile)
+    except (OSError, ValueError):
+        return None
+
+
+## write a json document atomically so concurrent runs never read half a file,
+## mode restricts the permissions of files holding secrets
+def writeCache(name, data, mode=None):
+    path = cachePath(name)
+    tmppath = "%s.%d.tmp" %(path, os.getpid())
+    try:
+        fd = os.open(tmppath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666 if mode is None else mode)
+        if mode is not None:
+            os.fchmod(fd, mode)
+        with os.fdopen(fd, 'w') as cachefile:
+            json.dump(data, cachefile)
+        os.replace(tmppath, path)
+    except OSError as e:
+        logging.warning("Failed to write cache %s: %s" %(path, e))
+
+
+def removeCache(name):
+    try:
+        os.remove(cachePath(name))
+    except OSError:
+        pass
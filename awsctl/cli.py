@@ -0,0 +1,63 @@
+#
+# Purpose :     Single entry point for the scripts, ej: awsctl ec2 instances list
+# Author:       Ivan Martinez
+# Dependencies: python3
+#
+
+import os
+import sys
+import importlib.util
+from collections import OrderedDict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+## (service, resource) -> (script implementing the command, description)
+COMMANDS = OrderedDict([
+    (('ec2', 'instances'), ('ec2/aws-ec2-instance.py', 'list/start/stop/status/watch/sync instances')),
+    (('ec2', 'elastic-ips'), ('ec2/aws-ec2-elastic-ips.py', 'list/add/associate/disassociate/release/orphans/batch/sync Elastic IPs')),
+    (('ec2', 'security-groups'), ('ec2/aws-ec2-security-groups.py', 'list/rules/exposure/graph/unused/sync security groups')),
+    (('iam', 'users'), ('iam/aws-iam-list-users.py', 'list/details/sync IAM users')),
+])
+
+
+def usage(stream):
+    stream.write("usage: awsctl SERVICE RESOURCE ACTION [options]\n\ncommands:\n")
+    for (service, resource), (script, description) in COMMANDS.items():
+        stream.write("  %-24s %s\n" %("%s %s" %(service, resource), description))
+    stream.write("  %-24s %s\n" %("daemon", "serve/stop/status the daemon keeping clients warm"))
+    stream.write("\nRun awsctl SERVICE RESOURCE -h for the options of a command.\n")
+
+
+## Import the script of a command, only the selected one is loaded so that
+## the other commands and boto3 add nothing to the startup time
+def loadCommand(service, resource):
+    script = COMMANDS[(service, resource)][0]
+    name = "awsctl_%s_%s" %(service, resource.replace("-", "_"))
+    module = sys.modules.get(name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, script))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == "daemon":
+        from awsctl.daemon import main as daemonMain
+        return daemonMain(argv[1:])
+    if len(argv) < 2 or tuple(argv[:2]) not in COMMANDS:
+        if argv and argv[0] in ("-h", "--help"):
+            usage(sys.stdout)
+            return 0
+        usage(sys.stderr)
+        return 2
+    service, resource = argv[:2]
+    from awsctl.daemon import forward
+    code = forward(service, resource, argv[2:])
+    if code is not None:
+        return code
+    module = loadCommand(service, resource)
+    return module.main(argv[2:], prog="awsctl %s %s" %(service, resource))
@@ -0,0 +1,107 @@
+#
+# Purpose :     Shared, thread safe registry of boto3 sessions and clients
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+import threading
+
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+RETRY_MODES = ('legacy', 'standard', 'adaptive')
+DEFAULT_RETRY_MODE = 'adaptive'
+DEFAULT_MAX_ATTEMPTS = 10
+
+
+## Keeps one boto3 client per (profile, region, service) so connection pools
+## and TLS sessions are reused across calls and worker threads.
+## boto3 sessions are not thread safe, so client creation happens under a lock;
+## the clients themselves can be shared between threads.
+## In adaptive retry mode botocore keeps a token bucket rate limiter per client that
+## slows down on throttling responses and speeds up again on success. As every thread
+## gets the same client per (profile, region, service), they all share that limiter
+## and parallel calls stay within the API quota of the account.
+class ClientRegistry(object):
+
+    def __init__(self, profile=None, maxPoolConnections=DEFAULT_MAX_POOL_CONNECTIONS, keepAlive=True,
+                 retryMode=DEFAULT_RETRY_MODE, maxAttempts=DEFAULT_MAX_ATTEMPTS):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._clients = {}
+        ## optional awsctl.metrics.Metrics instrumenting every new client
+        self.metrics = None
+        self.configure(profile, maxPoolConnections, keepAlive, retryMode, maxAttempts)
+
+    ## change defaults for clients created from now on, existing clients are dropped
+    ## when the options change and kept warm when only the default profile does
+    def configure(self, profile=None, maxPoolConnections=DEFAULT_MAX_POOL_CONNECTIONS, keepAlive=True,
+                  retryMode=DEFAULT_RETRY_MODE, maxAttempts=DEFAULT_MAX_ATTEMPTS):
+        options = dict(max_pool_connections=maxPoolConnections, tcp_keepalive=keepAlive,
+                       retries={'mode': retryMode, 'max_attempts': maxAttempts})
+        with self._lock:
+            self.profile = profile
+            if options != getattr(self, 'options', None):
+                self.options = options
+                self.config = None
+                self._clients.clear()
+
+    def getSession(self, profile=None):
+        if profile is None:
+            profile = self.profile
+        with self._lock:
+            return self._getSession(profile)
+
+    ## use temporary credentials, ej: from awsctl.credentials.assumeRole, for the
+    ## sessions and clients of profile instead of the shared config files. region
+    ## is the default region of the session, it has no profile to read it from.
+    def setCredentials(self, profile, credentials, region=None):
+        import boto3
+        session = boto3.session.Session(aws_access_key_id=credentials['AccessKeyId'],
+                                        aws_secret_access_key=credentials['SecretAccessKey'],
+                                        aws_session_token=credentials.get('SessionToken'),
+                                        region_name=region)
+        with self._lock:
+            self._sessions[profile] = session
+            for key in [key for key in self._clients if key[0] == profile]:
+                del self._clients[key]
+
+    def _getSession(self, profile):
+        session = self._sessions.get(profile)
+        if session is None:
+            ## boto3 is imported on first use so that -h, argument errors and cached
+            ## answers do not pay for it
+            import boto3
+            session = boto3.session.Session(profile_name=profile)
+            self._sessions[profile] = session
+        return session
+
+    def getClient(self, service, region=None, profile=None):
+        if profile is None:
+            profile = self.profile
+        key = (profile, region, service)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    session = self._getSession(profile)
+                    if self.config is None:
+                        from botocore.config import Config
+                        self.config = Config(**self.options)
+                    client = session.client(service, region_name=region, config=self.config)
+                    if self.metrics is not None:
+                        self.metrics.instrument(client)
+                    self._clients[key] = client
+        return client
+
+
+## process wide registry used by all scripts
+registry = ClientRegistry()
+
+
+def configureClients(profile=None, maxPoolConnections=DEFAULT_MAX_POOL_CONNECTIONS, keepAlive=True,
+                     retryMode=DEFAULT_RETRY_MODE, maxAttempts=DEFAULT_MAX_ATTEMPTS):
+    registry.configure(profile, maxPoolConnections, keepAlive, retryMode, maxAttempts)
+
+
+def getClient(service, region=None, profile=None):
+    return registry.getClient(service, region, profile)
@@ -0,0 +1,58 @@
+#
+# Purpose :     Cross account AssumeRole with an on-disk, expiry aware credential cache
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+import hashlib
+import logging
+import time
+from datetime import datetime
+
+from awsctl.cache import readCache, writeCache
+from awsctl.clients import getClient
+
+DEFAULT_ROLE_NAME = 'OrganizationAccountAccessRole'
+DEFAULT_SESSION_NAME = 'awsctl'
+DEFAULT_DURATION = 3600
+## credentials expiring within this many seconds are assumed again
+MIN_REMAINING = 300
+
+
+def roleArn(account, roleName):
+    return "arn:aws:iam::%s:role/%s" %(account, roleName)
+
+
+def credentialsCacheName(profile, arn):
+    key = hashlib.sha256(("%s\n%s" %(profile, arn)).encode()).hexdigest()[:32]
+    return "credentials-%s.json" %(key)
+
+
+def _expiration(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.strptime(value.replace("Z", "+0000"), "%Y-%m-%dT%H:%M:%S%z").timestamp()
+
+
+## Temporary credentials of roleName in account, assumed from profile.
+## They are reused from the cache until MIN_REMAINING seconds before they expire,
+## so repeated runs and parallel workers do not call STS again.
+def assumeRole(profile, account, roleName=DEFAULT_ROLE_NAME, duration=DEFAULT_DURATION, sessionName=DEFAULT_SESSION_NAME):
+    arn = roleArn(account, roleName)
+    name = credentialsCacheName(profile, arn)
+    cached = readCache(name)
+    if cached and cached.get('Expiration', 0) - time.time() > MIN_REMAINING:
+        return cached
+
+    logging.info("Assuming role %s" %(arn))
+    response = getClient('sts', profile=profile).assume_role(RoleArn=arn, RoleSessionName=sessionName, DurationSeconds=duration)
+    credentials = response['Credentials']
+    cached = {
+        'AccessKeyId': credentials['AccessKeyId'],
+        'SecretAccessKey': credentials['SecretAccessKey'],
+        'SessionToken': credentials['SessionToken'],
+        'Expiration': _expiration(credentials['Expiration']),
+    }
+    writeCache(name, cached, mode=0o600)
+    return cached
+
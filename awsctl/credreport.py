@@ -0,0 +1,99 @@
+#
+# Purpose :     Audit IAM users from the account credential report
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+import csv
+import io
+import time
+from datetime import datetime, timezone
+
+REPORT_POLL_INTERVAL = 2
+REPORT_TIMEOUT = 300
+DEFAULT_MAX_KEY_AGE = 90
+DEFAULT_MAX_INACTIVE = 90
+ROOT_USER = "<root_account>"
+## report values of the date columns when there is no date
+NO_DATES = ("", "N/A", "no_information", "not_supported")
+
+
+## Ask Aws to generate the credential report and poll until it is ready. Aws
+## answers COMPLETE right away while the last report is younger than 4 hours.
+def generateCredentialReport(client, interval=REPORT_POLL_INTERVAL, timeout=REPORT_TIMEOUT):
+    deadline = time.time() + timeout
+    while client.generate_credential_report().get('State') != 'COMPLETE':
+        if time.time() > deadline:
+            raise TimeoutError("Credential report not ready after %d seconds" %(timeout))
+        time.sleep(interval)
+
+
+## Stream of the rows of the credential report as dicts, parsed line by line
+def credentialReportRows(client):
+    content = client.get_credential_report()['Content']
+    return csv.DictReader(io.TextIOWrapper(io.BytesIO(content), encoding='utf-8', newline=''))
+
+
+def reportDate(value):
+    if value in NO_DATES:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def ageDays(date, now):
+    return int((now - date).total_seconds() // 86400)
+
+
+## columns of auditUser rows
+AUDIT_COLUMNS = ("Name", "ID", "Password", "MFA", "Key 1 Age", "Key 2 Age", "Last Activity", "Findings")
+
+
+## Audit row of a credential report row. Findings are no-mfa for a user with a
+## console password and no MFA device, stale-key-N for an active access key
+## older than maxKeyAge days and inactive for a user not seen for maxInactive days.
+def auditUser(row, userId, maxKeyAge=DEFAULT_MAX_KEY_AGE, maxInactive=DEFAULT_MAX_INACTIVE, now=None):
+    now = now or datetime.now(timezone.utc)
+    findings = []
+    ## the root account has no console password flag, it always has one
+    password = row.get('password_enabled') != 'false'
+    mfa = row.get('mfa_active') == 'true'
+    if password and not mfa:
+        findings.append("no-mfa")
+
+    keyAges = []
+    lastUsed = [reportDate(row.get('password_last_used', ""))]
+    for key in ("1", "2"):
+        if row.get('access_key_%s_active' %(key)) != 'true':
+            keyAges.append("")
+            continue
+        rotated = reportDate(row.get('access_key_%s_last_rotated' %(key), ""))
+        age = ageDays(rotated, now) if rotated else None
+        keyAges.append("" if age is None else age)
+        if age is not None and age > maxKeyAge:
+            findings.append("stale-key-%s" %(key))
+        lastUsed.append(reportDate(row.get('access_key_%s_last_used_date' %(key), "")))
+
+    ## never used credentials count from the creation of the user
+    lastUsed = [date for date in lastUsed if date is not None]
+    lastActivity = max(lastUsed) if lastUsed else None
+    since = lastActivity or reportDate(row.get('user_creation_time', ""))
+    if since is not None and ageDays(since, now) > maxInactive:
+        findings.append("inactive")
+
+    return (row.get('user'), userId, "yes" if password else "no", "yes" if mfa else "no", keyAges[0], keyAges[1],
+            lastActivity.isoformat() if lastActivity else "never", ",".join(findings))
+
+
+## Merge the credential report with the users of list_users in one pass: users
+## maps the user names to their ID. Users deleted since the report are skipped,
+## users created since it are reported as not-in-report.
+def auditUsers(rows, users, maxKeyAge=DEFAULT_MAX_KEY_AGE, maxInactive=DEFAULT_MAX_INACTIVE):
+    now = datetime.now(timezone.utc)
+    users = dict(users)
+    for row in rows:
+        name = row.get('user')
+        if name != ROOT_USER and name not in users:
+            continue
+        yield auditUser(row, users.pop(name, ""), maxKeyAge, maxInactive, now)
+    for name, userId in users.items():
+        yield (name, userId, "", "", "", "", "", "not-in-report")
@@ -0,0 +1,226 @@
+#
+# Purpose :     Daemon keeping boto3 sessions, clients and recent results warm,
+#               serving the read only actions of the scripts over a Unix socket
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+from contextlib import redirect_stdout
+
+from awsctl.cache import cachePath
+
+## actions answered by the daemon, the others always run in the calling process
+DAEMON_ACTIONS = ('list', 'status', 'rules', 'details')
+## seconds a result is reused for the same command line
+DEFAULT_RESULT_TTL = 10
+SOCKET_NAME = 'daemon.sock'
+## set to run every command locally even when a daemon is listening
+NO_DAEMON_ENV = 'AWSCTL_NO_DAEMON'
+
+
+## AWSCTL_SOCKET overrides the socket in the cache directory
+def socketPath():
+    return os.environ.get('AWSCTL_SOCKET') or cachePath(SOCKET_NAME)
+
+
+def _send(request, path=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path or socketPath())
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile('rb') as replies:
+            reply = replies.readline()
+    finally:
+        sock.close()
+    return json.loads(reply.decode()) if reply else None
+
+
+## Run a command on the daemon when one is listening, writing its output as if it
+## ran here. Returns the exit code, or None when the command has to run locally.
+def forward(service, resource, argv):
+    if os.environ.get(NO_DAEMON_ENV):
+        return None
+    path = socketPath()
+    if not os.path.exists(path):
+        return None
+    try:
+        reply = _send({"op": "run", "command": [service, resource], "argv": list(argv), "cwd": os.getcwd()}, path)
+    except (OSError, ValueError):
+        return None
+    if not reply or not reply.get("served"):
+        return None
+    sys.stderr.write(reply.get("stderr", ""))
+    sys.stdout.write(reply.get("stdout", ""))
+    sys.stdout.flush()
+    return reply.get("code", 0)
+
+
+## Runs the commands with the script modules loaded once, so boto3, the sessions,
+## credentials and clients of the process wide registry are reused by every request.
+## The scripts keep their state in module globals, so commands run one at a time;
+## answers from the result cache do not wait for the running command.
+class CommandRunner(object):
+
+    def __init__(self, ttl=DEFAULT_RESULT_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cacheLock = threading.Lock()
+        self._results = {}
+        self.requests = 0
+        self.hits = 0
+        self.started = time.time()
+        ## the log of a command is captured by pointing the root handler to its reply
+        root = logging.getLogger()
+        if not root.handlers:
+            logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+        self.logHandler = root.handlers[0]
+
+    def cached(self, key):
+        with self._cacheLock:
+            self.requests += 1
+            result = self._results.get(key)
+            if result is not None and time.time() - result[0] <= self.ttl:
+                self.hits += 1
+                return result[1]
+            self._results.pop(key, None)
+            return None
+
+    def run(self, service, resource, argv, cwd):
+        from awsctl.cli import COMMANDS, loadCommand
+        if (service, resource) not in COMMANDS:
+            return {"served": False}
+        key = json.dumps([service, resource, argv, cwd])
+        reply = self.cached(key)
+        if reply is not None:
+            return reply
+
+        with self._lock:
+            module = loadCommand(service, resource)
+            ## argument errors and -h are left to the calling process
+            try:
+                with redirect_stdout(io.StringIO()):
+                    args = module.buildParser().parse_args(argv)
+            except SystemExit:
+                return {"served": False}
+            if (args.action not in DAEMON_ACTIONS or getattr(args, 'metrics', None)
+                    or getattr(args, 'profiles', None) or getattr(args, 'accounts', None)
+                    or getattr(args, 'since', None)):
+                return {"served": False}
+
+            stdout = io.StringIO()
+            stderr = io.StringIO()
+            code = 0
+            saved = os.getcwd()
+            self.logHandler.setStream(stderr)
+            try:
+                os.chdir(cwd)
+                with redirect_stdout(stdout):
+                    module.main(argv, prog="awsctl %s %s" %(service, resource))
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except Exception as e:
+                stderr.write("[ERROR] %s\n" %(e))
+                code = 1
+            finally:
+                self.logHandler.setStream(sys.stderr)
+                os.chdir(saved)
+
+        reply = {"served": True, "code": code, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+        if code == 0:
+            with self._cacheLock:
+                self._results[key] = (time.time(), reply)
+        return reply
+
+    def status(self):
+        with self._cacheLock:
+            return {"pid": os.getpid(), "uptime": time.time() - self.started, "requests": self.requests,
+                    "cache_hits": self.hits, "cached_results": len(self._results), "ttl": self.ttl}
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line.decode())
+        except ValueError:
+            return
+        op = request.get("op")
+        runner = self.server.runner
+        if op == "run":
+            service, resource = request.get("command", [None, None])
+            reply = runner.run(service, resource, request.get("argv", []), request.get("cwd") or os.getcwd())
+        elif op == "status":
+            reply = runner.status()
+        elif op == "stop":
+            reply = {"stopping": True}
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            reply = {"error": "unknown op %s" %(op)}
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path=None, ttl=DEFAULT_RESULT_TTL):
+    path = path or socketPath()
+    if os.path.exists(path):
+        try:
+            _send({"op": "status"}, path)
+            logging.error("A daemon is already listening on %s" %(path))
+            return 1
+        except OSError:
+            ## left behind by a daemon that did not stop cleanly
+            os.remove(path)
+    ## commands run inside the daemon must not forward to it
+    os.environ[NO_DAEMON_ENV] = "1"
+    oldUmask = os.umask(0o077)
+    try:
+        server = DaemonServer(path, DaemonHandler)
+    finally:
+        os.umask(oldUmask)
+    server.runner = CommandRunner(ttl)
+    logging.info("Listening on %s, results are reused for %ds" %(path, ttl))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return 0
+
+
+## awsctl daemon serve/stop/status
+def main(argv=None, prog="awsctl daemon"):
+    argparser = argparse.ArgumentParser(prog=prog, description='Keep Aws clients warm and answer %s over a Unix socket' %("/".join(DAEMON_ACTIONS)))
+    argparser.add_argument('action', choices=('serve', 'stop', 'status'), help='Run the daemon in the foreground, stop it or show its status')
+    argparser.add_argument('--socket', help='Path of the Unix socket, default is %s in the cache directory' %(SOCKET_NAME))
+    argparser.add_argument('--ttl', type=int, default=DEFAULT_RESULT_TTL, help='Seconds a result is reused for the same command line, 0 disables it')
+    args = argparser.parse_args(argv)
+    logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+
+    if args.action == "serve":
+        return serve(args.socket, args.ttl)
+    try:
+        reply = _send({"op": args.action}, args.socket)
+    except OSError:
+        logging.error("No daemon is listening on %s" %(args.socket or socketPath()))
+        return 1
+    print(json.dumps(reply, indent=2))
+    return 0
@@ -0,0 +1,168 @@
+#
+# Purpose :     Index security group rules by CIDR prefix and port range
+# Author:       Ivan Martinez
+# Dependencies: python3
+#
+
+from bisect import bisect_right
+from operator import itemgetter
+from sys import intern
+import ipaddress
+
+ALL_PORTS = (0, 65535)
+## protocol numbers Aws may return instead of names
+PROTOCOL_NAMES = {'6': 'tcp', '17': 'udp', '1': 'icmp', '58': 'icmpv6'}
+
+
+def internString(value):
+    return intern(value) if isinstance(value, str) else value
+
+
+def nullValue(value):
+    return "NULL" if value is None else value
+
+
+## One entry of the permissions of a security group, in __slots__ with the
+## strings repeated across rules interned, as indexes may hold millions of them
+class Rule(object):
+
+    __slots__ = ('region', 'groupId', 'groupName', 'direction', 'protocol', 'fromPort', 'toPort', 'cidr', 'description')
+
+    def __init__(self, region, groupId, groupName, direction, protocol, fromPort, toPort, cidr, description):
+        self.region = internString(region)
+        self.groupId = groupId
+        self.groupName = groupName
+        self.direction = internString(direction)
+        self.protocol = internString(protocol)
+        self.fromPort = fromPort
+        self.toPort = toPort
+        ## the same few networks, like 0.0.0.0/0, appear in most rules
+        self.cidr = internString(cidr)
+        self.description = description
+
+    ## values of the RULE_COLUMNS of aws-ec2-security-groups.py, peer is cidr
+    def row(self):
+        return (self.region, self.groupId, self.groupName, self.direction, nullValue(self.protocol),
+                nullValue(self.fromPort), nullValue(self.toPort), self.cidr, self.description)
+
+
+## Yield (direction, protocol, from port, to port, peer, description) for every
+## entry of the inbound and outbound permissions of a security group. peer is an
+## IPv4/IPv6 CIDR, a referenced security group ID or a prefix list ID.
+def groupRules(secgroup):
+    for direction, permissions in (("inbound", secgroup.get('IpPermissions', [])),
+                                   ("outbound", secgroup.get('IpPermissionsEgress', []))):
+        for permission in permissions:
+            protocol  = permission.get("IpProtocol")
+            from_port = permission.get("FromPort")
+            to_port   = permission.get("ToPort")
+
+            for ipr in permission.get('IpRanges', []):
+                yield direction, protocol, from_port, to_port, ipr.get("CidrIp"), ipr.get("Description")
+
+            for ip6r in permission.get('Ipv6Ranges', []):
+                yield direction, protocol, from_port, to_port, ip6r.get("CidrIpv6"), ip6r.get("Description")
+
+            for pair in permission.get('UserIdGroupPairs', []):
+                yield direction, protocol, from_port, to_port, pair.get("GroupId"), pair.get("Description")
+
+            for prefix in permission.get('PrefixListIds', []):
+                yield direction, protocol, from_port, to_port, prefix.get("PrefixListId"), prefix.get("Description")
+
+
+def normalizeProtocol(protocol):
+    protocol = str(protocol).lower()
+    if protocol in ("-1", "all", "any"):
+        return None
+    return PROTOCOL_NAMES.get(protocol, protocol)
+
+
+## True when a rule of protocol (normalized, None is all) can allow a port,
+## icmp and the other protocols without ports never do
+def allowsPorts(protocol):
+    return protocol in (None, "tcp", "udp")
+
+
+## port range a rule applies to, all ports for -1 rules and icmp types
+def portRange(protocol, fromPort, toPort):
+    if protocol not in ("tcp", "udp") or fromPort is None or fromPort == -1:
+        return ALL_PORTS
+    return (fromPort, toPort if toPort is not None else fromPort)
+
+
+## Rules bucketed by (direction, ip version, prefix length, network). A query
+## for an address or network only looks at the buckets of the networks that
+## contain it, one per prefix length in use, and inside a bucket the rules are
+## kept sorted by first port so port ranges are cut with a binary search.
+class ExposureIndex(object):
+
+    def __init__(self):
+        self.buckets = {}
+        self.sortedBuckets = {}
+        self.prefixes = set()
+        self.size = 0
+
+    def add(self, rule):
+        try:
+            network = ipaddress.ip_network(rule.cidr, strict=False)
+        except ValueError:
+            return
+        prefix = (rule.direction, network.version, network.prefixlen)
+        self.prefixes.add(prefix)
+        self.buckets.setdefault(prefix + (int(network.network_address),), []).append(rule)
+        self.sortedBuckets = None
+        self.size += 1
+
+    def addGroup(self, region, secgroup):
+        for direction, protocol, from_port, to_port, cidr, desc in groupRules(secgroup):
+            ## referenced groups and prefix lists are not networks, add() skips them
+            if cidr:
+                self.add(Rule(region, secgroup.get('GroupId'), secgroup.get('GroupName'), direction,
+                              protocol, from_port, to_port, cidr, desc))
+
+    ## rules of awsctl.records.SecurityGroup records
+    def addRules(self, rules):
+        for rule in rules:
+            if rule.cidr:
+                self.add(rule)
+
+    ## sort every bucket by port range, keeping the first ports apart for bisect
+    def _sort(self):
+        self.sortedBuckets = {}
+        for key, rules in self.buckets.items():
+            ranked = sorted(((portRange(normalizeProtocol(rule.protocol), rule.fromPort, rule.toPort), rule) for rule in rules), key=itemgetter(0))
+            self.sortedBuckets[key] = ([ports[0] for ports, _ in ranked], [rule for _, rule in ranked])
+
+    ## Rules allowing traffic from (inbound) or to (outbound) every address of
+    ## cidr, optionally on protocol/port, sorted by region and group
+    def query(self, cidr, protocol=None, port=None, direction="inbound"):
+        if self.sortedBuckets is None:
+            self._sort()
+        network = ipaddress.ip_network(cidr, strict=False)
+        address = int(network.network_address)
+        bits = network.max_prefixlen
+        protocol = normalizeProtocol(protocol) if protocol is not None else None
+
+        found = []
+        for prefixDirection, version, prefixlen in self.prefixes:
+            if prefixDirection != direction or version != network.version or prefixlen > network.prefixlen:
+                continue
+            key = (direction, version, prefixlen, address >> (bits - prefixlen) << (bits - prefixlen))
+            bucket = self.sortedBuckets.get(key)
+            if bucket is None:
+                continue
+
+            starts, rules = bucket
+            end = bisect_right(starts, port) if port is not None else len(rules)
+            for rule in rules[:end]:
+                ruleProtocol = normalizeProtocol(rule.protocol)
+                if protocol is not None and ruleProtocol is not None and ruleProtocol != protocol:
+                    continue
+                if port is not None and not allowsPorts(ruleProtocol):
+                    continue
+                if port is not None and portRange(ruleProtocol, rule.fromPort, rule.toPort)[1] < port:
+                    continue
+                found.append(rule)
+
+        found.sort(key=lambda rule: (rule.region, rule.groupId or "", rule.cidr))
+        return found
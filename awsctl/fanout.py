@@ -0,0 +1,101 @@
+#
+# Purpose :     Run a list action across many profiles or accounts in worker processes
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+import io
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+from awsctl.output import RecordWriter
+from awsctl.credentials import DEFAULT_ROLE_NAME
+
+DEFAULT_ACCOUNT_WORKERS = 8
+ACCOUNT_COLUMN = "Account"
+
+
+## (name, account) pairs, name is the profile used by the worker and the Account column
+def fanOutTargets(profiles, accounts):
+    targets = [(profile, None) for profile in (profiles or "").split(",") if profile]
+    targets += [("account-%s" %(account), account) for account in (accounts or "").split(",") if account]
+    return targets
+
+
+## Worker process: run the command for one target and return (code, jsonl output).
+## The options appended last override the ones of the caller, so the worker prints
+## every column as jsonl, for its own profile, and does not fan out again.
+def _runTarget(command, argv, name, account, baseProfile, roleName):
+    from awsctl.cli import loadCommand
+    from awsctl.clients import registry
+    from awsctl.credentials import assumeRole
+
+    ## forked workers inherit the handler of the caller, force prefixes their lines with the target
+    logging.basicConfig(format='[%%(levelname)s] [%s] %%(message)s' %(account or name), level=logging.INFO, force=True)
+    try:
+        if account:
+            ## the account session uses the default region of the profile it was assumed from
+            registry.setCredentials(name, assumeRole(baseProfile, account, roleName), registry.getSession(baseProfile).region_name)
+        module = loadCommand(*command)
+    except Exception as e:
+        logging.error(e)
+        return 1, ""
+
+    output = io.StringIO()
+    code = 0
+    try:
+        with redirect_stdout(output):
+            module.main(argv + ['--output', 'jsonl', '--fields', '', '--profiles', '', '--accounts', '', '--profile', name])
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception as e:
+        logging.error(e)
+        code = 1
+    return code, output.getvalue()
+
+
+## Run argv of command (service, resource) once per profile or account of args in
+## parallel processes and write the rows with writer's columns, format and fields,
+## prefixed by the Account column. Returns the exit code.
+def fanOut(command, argv, args, writer, actions):
+    if args.action not in actions:
+        logging.error("Action %s can not be run across profiles or accounts, valid actions are: %s" %(args.action, ", ".join(actions)))
+        return 1
+    targets = fanOutTargets(args.profiles, args.accounts)
+    if not targets:
+        logging.error("No profiles or accounts to run %s on." %(args.action))
+        return 1
+
+    columns = (ACCOUNT_COLUMN,) + tuple(writer.columns)
+    output = RecordWriter(columns, [0] + [i + 1 for i in writer.fields], writer.fmt)
+    output.header()
+    failed = []
+    workers = max(1, min(args.account_workers, len(targets)))
+    baseProfile = args.profile
+    roleName = getattr(args, 'role_name', None) or DEFAULT_ROLE_NAME
+    logging.info("Running %s on %d targets with %d workers..." %(args.action, len(targets), workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_runTarget, command, list(argv), name, account, baseProfile, roleName)
+                   for name, account in targets]
+        ## results are written in the order of the targets as soon as they are ready
+        for (name, account), future in zip(targets, futures):
+            try:
+                code, lines = future.result()
+            except Exception as e:
+                logging.error("%s: %s" %(account or name, e))
+                code, lines = 1, ""
+            if code:
+                failed.append(account or name)
+            for line in lines.splitlines():
+                if line.startswith("{"):
+                    record = json.loads(line)
+                    output.write((account or name,) + tuple(record.get(column) for column in writer.columns))
+            output.flush()
+    output.close()
+
+    if failed:
+        logging.error("Failed on %d targets: %s" %(len(failed), " ".join(failed)))
+        return 1
+    return 0
@@ -0,0 +1,149 @@
+#
+# Purpose :     Build EC2 server side Filters from command line arguments
+# Author:       Ivan Martinez
+# Dependencies: python3
+#
+
+from fnmatch import fnmatchcase
+
+
+## Parse KEY=VALUE tag expressions into (key, value) pairs. value is None for
+## KEY and KEY=*, matching every resource having the tag key, other values may
+## use the * and ? wildcards.
+def parseTagQuery(tags):
+    query = []
+    for tag in tags or []:
+        key, _, value = tag.partition("=")
+        if not key:
+            raise ValueError("Tag %s must be KEY=VALUE, KEY=* or KEY" %(tag))
+        query.append((key, None if value in ("", "*") else value))
+    return query
+
+
+## Convert KEY=VALUE tag expressions into EC2 filters
+def tagFilters(tags):
+    filters = []
+    for key, value in parseTagQuery(tags):
+        if value is None:
+            filters.append({'Name': 'tag-key', 'Values': [key]})
+        else:
+            filters.append({'Name': 'tag:%s' %(key), 'Values': [value]})
+    return filters
+
+
+## short filter names accepted by --filter, anything else is passed to Aws as is
+FILTER_ALIASES = {
+    'instances':       {'state': 'instance-state-name', 'vpc': 'vpc-id', 'type': 'instance-type', 'name': 'tag:Name'},
+    'elastic_ips':     {'instance': 'instance-id', 'ip': 'public-ip', 'name': 'tag:Name'},
+    'security_groups': {'vpc': 'vpc-id', 'name': 'group-name'},
+}
+
+
+## Convert --filter NAME=VALUE[,VALUE] expressions of a resource into EC2
+## Filters. Returns (filters, predicate): predicate is None or a function that
+## keeps the records matching conditions EC2 can not filter on the server side,
+## like association=unassociated for elastic ips.
+def buildFilters(resource, expressions):
+    aliases = FILTER_ALIASES.get(resource, {})
+    filters = []
+    predicate = None
+    for expression in expressions or []:
+        name, sep, value = expression.partition("=")
+        if not sep or not name:
+            raise ValueError("Filter %s must be NAME=VALUE" %(expression))
+
+        if name == "association" and resource == "elastic_ips":
+            if value == "associated":
+                filters.append({'Name': 'association-id', 'Values': ['*']})
+            elif value == "unassociated":
+                predicate = lambda record: not record.get("AssociationId")
+            else:
+                raise ValueError("Association filter must be associated or unassociated")
+            continue
+
+        filters.append({'Name': aliases.get(name, name), 'Values': value.split(",")})
+    return filters, predicate
+
+
+## record fields of the Aws filter names the local inventory can answer
+INVENTORY_FIELDS = {
+    'instance-state-name': ('State', 'Name'),
+    'instance-type':       ('InstanceType',),
+    'instance-id':         ('InstanceId',),
+    'vpc-id':              ('VpcId',),
+    'group-id':            ('GroupId',),
+    'group-name':          ('GroupName',),
+    'public-ip':           ('PublicIp',),
+    'allocation-id':       ('AllocationId',),
+    'association-id':      ('AssociationId',),
+    'domain':              ('Domain',),
+}
+
+
+def _fieldValue(record, path):
+    for key in path:
+        record = record.get(key) if isinstance(record, dict) else None
+    return record
+
+
+def _tagValues(record, key):
+    return [tag.get('Value') for tag in record.get('Tags') or [] if tag.get('Key') == key]
+
+
+def _hasWildcard(value):
+    return "*" in value or "?" in value
+
+
+def _matchesAny(value, patterns):
+    return value is not None and any(fnmatchcase(str(value), pattern) for pattern in patterns)
+
+
+## Answer the filters of buildFilters from the local inventory. Returns the
+## Inventory.records arguments: single value tag filters use the tag index, a
+## single vpc-id the vpc index, and the others become a predicate on the cached
+## records, with the one of buildFilters. Values match like on Aws, any of the
+## values and with * and ? wildcards.
+## Raises ValueError for filters the local inventory can not answer.
+def inventoryQuery(filters, predicate=None):
+    query = {'tags': [], 'vpc': None, 'predicate': None}
+    checks = []
+    for flt in filters:
+        name, values = flt['Name'], flt['Values']
+        if name == "tag-key" and len(values) == 1:
+            query['tags'].append((values[0], None))
+        elif name == "tag-key":
+            checks.append(lambda record, keys=values: any(_matchesAny(tag.get('Key'), keys) for tag in record.get('Tags') or []))
+        elif name.startswith("tag:") and len(values) == 1:
+            query['tags'].append((name[4:], None if values[0] == "*" else values[0]))
+        elif name.startswith("tag:"):
+            checks.append(lambda record, key=name[4:], patterns=values: any(_matchesAny(value, patterns) for value in _tagValues(record, key)))
+        elif name == "vpc-id" and query['vpc'] is None and len(values) == 1 and not _hasWildcard(values[0]):
+            query['vpc'] = values[0]
+        elif name in INVENTORY_FIELDS:
+            checks.append(lambda record, path=INVENTORY_FIELDS[name], patterns=values: _matchesAny(_fieldValue(record, path), patterns))
+        else:
+            raise ValueError("Filter %s can not be answered from the local inventory, valid filters are: %s"
+                             %(name, ", ".join(sorted(INVENTORY_FIELDS) + ["tag:KEY", "tag-key"])))
+
+    def matches(record):
+        return all(check(record) for check in checks) and (predicate is None or predicate(record))
+
+    if checks or predicate is not None:
+        query['predicate'] = matches
+    return query
+
+
+## Indexes of the requested comma separated fields in columns, matched ignoring
+## case and spaces. All columns when fields is empty.
+def projectFields(columns, fields):
+    if not fields:
+        return list(range(len(columns)))
+
+    lookup = dict((column.replace(" ", "").lower(), index) for index, column in enumerate(columns))
+    indexes = []
+    for field in fields.split(","):
+        key = field.replace(" ", "").lower()
+        if key not in lookup:
+            raise ValueError("Unknown field %s, valid fields are: %s" %(field, ", ".join(columns)))
+        indexes.append(lookup[key])
+    return indexes
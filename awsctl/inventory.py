@@ -0,0 +1,198 @@
+#
+# Purpose :     Local SQLite snapshot of the Aws inventory for offline queries
+# Author:       Ivan Martinez
+# Dependencies: python3
+#
+
+from itertools import groupby
+from operator import itemgetter
+import json
+import sqlite3
+import time
+from awsctl.cache import cachePath
+from awsctl.regions import runRegions, DEFAULT_WORKERS
+
+## seconds after which a synced region is considered stale
+DEFAULT_MAX_AGE = 900
+## pseudo region used for global services like IAM
+GLOBAL_REGION = "global"
+
+## resource type -> (id field, vpc field) of its boto3 records
+RESOURCES = {
+    'instances':       ('InstanceId', 'VpcId'),
+    'elastic_ips':     ('AllocationId', None),
+    'security_groups': ('GroupId', 'VpcId'),
+    'iam_users':       ('UserId', None),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    resource TEXT NOT NULL,
+    region   TEXT NOT NULL,
+    id       TEXT NOT NULL,
+    name     TEXT,
+    vpc_id   TEXT,
+    data     TEXT NOT NULL,
+    PRIMARY KEY (resource, id)
+);
+CREATE INDEX IF NOT EXISTS records_region ON records (resource, region);
+CREATE INDEX IF NOT EXISTS records_vpc ON records (resource, vpc_id);
+CREATE INDEX IF NOT EXISTS records_name ON records (resource, name);
+CREATE TABLE IF NOT EXISTS tags (
+    resource TEXT NOT NULL,
+    key      TEXT NOT NULL,
+    value    TEXT NOT NULL,
+    id       TEXT NOT NULL,
+    region   TEXT NOT NULL,
+    PRIMARY KEY (resource, key, value, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_region ON tags (resource, region);
+CREATE TABLE IF NOT EXISTS sync_state (
+    resource  TEXT NOT NULL,
+    region    TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (resource, region)
+);
+"""
+
+_RECORD = 0
+_COMPLETE = 1
+
+
+## value of the Name tag, or the group/user name for resources without tags
+def recordName(record):
+    for tag in record.get('Tags') or []:
+        if tag.get('Key') == 'Name':
+            return tag.get('Value')
+    return record.get('GroupName') or record.get('UserName')
+
+
+## (key, value) pairs of the Tags of a boto3 record
+def recordTags(record):
+    for tag in record.get('Tags') or []:
+        if tag.get('Key') is not None:
+            yield tag['Key'], tag.get('Value') or ""
+
+
+def inventoryPath(profile):
+    return cachePath("inventory-%s.db" %(profile or "default"))
+
+
+## Records are stored as json with their id, name and vpc as indexed columns.
+## The tags table is an inverted index of the tags of every record, clustered by
+## (resource, key, value) so a tag query reads only the ids having that tag,
+## whatever the region, instead of scanning the records.
+class Inventory(object):
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        hasTags = self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tags'").fetchone()
+        self.db.executescript(SCHEMA)
+        if not hasTags:
+            self.rebuildTags()
+
+    def close(self):
+        self.db.close()
+
+    ## regions of the list never synced for resource or synced more than maxAge seconds ago
+    def staleRegions(self, resource, regions, maxAge=DEFAULT_MAX_AGE):
+        synced = dict(self.db.execute("SELECT region, synced_at FROM sync_state WHERE resource = ?", (resource,)))
+        now = time.time()
+        return [region for region in regions if now - synced.get(region, 0) > maxAge]
+
+    ## index the tags of the records synced before the tags table existed
+    def rebuildTags(self):
+        self.db.execute("BEGIN")
+        try:
+            self.db.execute("DELETE FROM tags")
+            for resource, region, recid, data in self.db.execute("SELECT resource, region, id, data FROM records").fetchall():
+                self._addTags(resource, region, recid, json.loads(data))
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def _addTags(self, resource, region, recid, record):
+        self.db.executemany("INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?)",
+                            ((resource, key, value, recid, region) for key, value in recordTags(record)))
+
+    ## Replace the records of one region inside a transaction. items is a stream
+    ## of (kind, record) tuples ending with a _COMPLETE entry; if the stream stops
+    ## before it (the region failed) the previous snapshot of the region is kept.
+    def replaceRegion(self, resource, region, items):
+        idField, vpcField = RESOURCES[resource]
+        complete = False
+        self.db.execute("BEGIN")
+        try:
+            self.db.execute("DELETE FROM records WHERE resource = ? AND region = ?", (resource, region))
+            self.db.execute("DELETE FROM tags WHERE resource = ? AND region = ?", (resource, region))
+            for kind, record in items:
+                if kind == _COMPLETE:
+                    complete = True
+                    break
+                recid = record.get(idField) or record.get('PublicIp')
+                self.db.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)", (
+                    resource, region, recid,
+                    recordName(record),
+                    record.get(vpcField) if vpcField else None,
+                    json.dumps(record, default=str, separators=(',', ':'))))
+                self._addTags(resource, region, recid, record)
+            if complete:
+                self.db.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)", (resource, region, time.time()))
+        finally:
+            self.db.execute("COMMIT" if complete else "ROLLBACK")
+        return complete
+
+    ## Yield (region, record) of a resource ordered by region, optionally
+    ## restricted to a list of regions, a list of ids, a vpc, a name, the
+    ## resources having all the tags of a filters.parseTagQuery list or the
+    ## records for which predicate(record) is true
+    def records(self, resource, regions=None, ids=None, vpc=None, name=None, tags=None, predicate=None):
+        query = "SELECT region, data FROM records WHERE resource = ?"
+        params = [resource]
+        if regions:
+            query += " AND region IN (%s)" %(", ".join("?" * len(regions)))
+            params.extend(regions)
+        if ids:
+            query += " AND id IN (%s)" %(", ".join("?" * len(ids)))
+            params.extend(ids)
+        if vpc is not None:
+            query += " AND vpc_id = ?"
+            params.append(vpc)
+        if name is not None:
+            query += " AND name = ?"
+            params.append(name)
+        if tags:
+            terms = []
+            for key, value in tags:
+                terms.append("SELECT id FROM tags WHERE resource = ? AND key = ?")
+                params.extend((resource, key))
+                if value is not None:
+                    terms[-1] += " AND value GLOB ?" if "*" in value or "?" in value else " AND value = ?"
+                    params.append(value)
+            query += " AND id IN (%s)" %(" INTERSECT ".join(terms))
+        query += " ORDER BY region, id"
+        for recregion, data in self.db.execute(query, params):
+            record = json.loads(data)
+            if predicate is None or predicate(record):
+                yield recregion, record
+
+
+## Refresh the stale regions of resource using fetch(region), which returns the
+## record stream of a region. Regions are fetched concurrently with runRegions and
+## written one by one; returns the list of regions that were refreshed.
+def syncRegions(inventory, resource, regions, fetch, maxAge=DEFAULT_MAX_AGE, workers=DEFAULT_WORKERS, onError=None):
+    stale = inventory.staleRegions(resource, regions, maxAge)
+
+    def fetchRegion(region):
+        for record in fetch(region):
+            yield (_RECORD, record)
+        yield (_COMPLETE, None)
+
+    synced = []
+    results = runRegions(stale, fetchRegion, workers, onError=onError)
+    for region, items in groupby(results, key=itemgetter(0)):
+        if inventory.replaceRegion(resource, region, (item for _, item in items)):
+            synced.append(region)
+    return synced
@@ -0,0 +1,129 @@
+#
+# Purpose :     Find the region of instances given by ID or Name tag
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+import re
+from collections import OrderedDict
+from operator import itemgetter
+
+from awsctl.cache import readCache, writeCache
+from awsctl.clients import getClient
+from awsctl.pagination import paginate, DEFAULT_PAGE_SIZE
+from awsctl.regions import runRegions, DEFAULT_WORKERS
+from awsctl.waiters import chunks, MAX_STATUS_IDS
+
+INSTANCE_ID = re.compile(r'^i-[0-9a-f]{8,17}$')
+
+
+def isInstanceID(target):
+    return INSTANCE_ID.match(target) is not None
+
+
+def _locationsCacheName(profile):
+    return "instance-locations-%s.json" %(profile or "default")
+
+
+def _instanceName(instance):
+    for tag in instance.get('Tags') or []:
+        if tag.get('Key') == 'Name':
+            return tag.get('Value')
+    return None
+
+
+## Instances of a region having one of ids or one of the Name tags in names and
+## matching every filter of filters, safe to run in a worker thread
+def findRegionInstances(region, ids, names, pageSize=DEFAULT_PAGE_SIZE, filters=()):
+    client = getClient('ec2', region)
+    ## instance-id and tag:Name filters are ANDed, so they are sent in separate calls.
+    ## Filters never fail on unknown IDs, unlike InstanceIds.
+    for chunk in chunks(sorted(ids), MAX_STATUS_IDS):
+        yield from paginate(client, 'describe_instances', 'Reservations[].Instances[]', pageSize,
+                            Filters=list(filters) + [{'Name': 'instance-id', 'Values': chunk}])
+    for chunk in chunks(sorted(names), MAX_STATUS_IDS):
+        yield from paginate(client, 'describe_instances', 'Reservations[].Instances[]', pageSize,
+                            Filters=list(filters) + [{'Name': 'tag:Name', 'Values': chunk}])
+
+
+## Persistent map of instance ID -> region and Name tag -> regions of a profile.
+## Entries are learned from list and from the probes of locate, and checked
+## lazily: locate first asks only the remembered regions, and probes every
+## region for the targets that are unknown or no longer there.
+class InstanceLocator(object):
+
+    def __init__(self, profile):
+        self.cacheName = _locationsCacheName(profile)
+        cached = readCache(self.cacheName) or {}
+        self.ids = cached.get('ids', {})
+        self.names = cached.get('names', {})
+        self.changed = False
+
+    def remember(self, region, iid, name=None):
+        if self.ids.get(iid) != region:
+            self.ids[iid] = region
+            self.changed = True
+        if name and region not in self.names.get(name, ()):
+            self.names.setdefault(name, []).append(region)
+            self.changed = True
+
+    def forget(self, iid=None, name=None):
+        if iid is not None and self.ids.pop(iid, None) is not None:
+            self.changed = True
+        if name is not None and self.names.pop(name, None) is not None:
+            self.changed = True
+
+    def save(self):
+        if self.changed:
+            writeCache(self.cacheName, {'ids': self.ids, 'names': self.names})
+            self.changed = False
+
+    ## region -> {'ids': set, 'names': set} of the remembered targets
+    def _remembered(self, ids, names):
+        regions = OrderedDict()
+        for iid in ids:
+            if iid in self.ids:
+                regions.setdefault(self.ids[iid], {'ids': set(), 'names': set()})['ids'].add(iid)
+        for name in names:
+            for region in self.names.get(name, ()):
+                regions.setdefault(region, {'ids': set(), 'names': set()})['names'].add(name)
+        return regions
+
+    ## Find targets, instance IDs or Name tags. Returns (region, instance) of
+    ## every match in region order and the targets found nowhere. allRegions is
+    ## only called when a target has to be probed in every region.
+    def locate(self, targets, allRegions, workers=DEFAULT_WORKERS, pageSize=DEFAULT_PAGE_SIZE, onError=None, refresh=False):
+        ids = set(target for target in targets if isInstanceID(target))
+        names = set(targets) - ids
+        found = OrderedDict()
+
+        def search(regions):
+            def findRegion(region):
+                return findRegionInstances(region, regions[region]['ids'], regions[region]['names'], pageSize)
+            for region, instance in runRegions(list(regions), findRegion, workers, onError=onError):
+                iid = instance.get('InstanceId')
+                if iid not in found:
+                    found[iid] = (region, instance)
+                    self.remember(region, iid, _instanceName(instance))
+
+        remembered = {} if refresh else self._remembered(ids, names)
+        if remembered:
+            search(remembered)
+
+        foundIds = set(found)
+        foundNames = set(_instanceName(instance) for _, instance in found.values())
+        missingIds = ids - foundIds
+        missingNames = names - foundNames
+        if missingIds or missingNames:
+            ## remembered entries that were not found are stale
+            for iid in missingIds:
+                self.forget(iid=iid)
+            for name in missingNames:
+                self.forget(name=name)
+            search(OrderedDict((region, {'ids': missingIds, 'names': missingNames}) for region in allRegions()))
+
+        self.save()
+        foundIds = set(found)
+        foundNames = set(_instanceName(instance) for _, instance in found.values())
+        missing = [target for target in targets if target not in foundIds and target not in foundNames]
+        return sorted(found.values(), key=itemgetter(0)), missing
@@ -0,0 +1,47 @@
+#
+# Purpose :     Read batch manifests of operations in csv or jsonl
+# Author:       Ivan Martinez
+# Dependencies: python3
+#
+
+import csv
+import json
+
+
+## Rows of a manifest as dicts with lower case keys. Files ending in .csv are
+## read as csv with a header line, anything else as one json object per line.
+def readManifest(path):
+    rows = []
+    with open(path, newline="") as manifest:
+        if path.lower().endswith(".csv"):
+            reader = csv.DictReader(manifest)
+            for row in reader:
+                rows.append(dict((key.strip().lower(), (value or "").strip()) for key, value in row.items() if key))
+        else:
+            for number, line in enumerate(manifest, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    raise ValueError("Line %d of %s is not valid json: %s" %(number, path, e))
+                rows.append(dict((key.lower(), value) for key, value in row.items()))
+    return rows
+
+
+## Tags of a manifest row as a list of {"Key", "Value"}. Accepts the json list
+## used by --tags, a json object, or Key=Value pairs separated by ;
+def parseTags(tags):
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.strip()
+        if tags.startswith("[") or tags.startswith("{"):
+            tags = json.loads(tags)
+        else:
+            pairs = [pair.partition("=") for pair in tags.split(";") if pair.strip()]
+            return [{'Key': key.strip(), 'Value': value.strip()} for key, _, value in pairs]
+    if isinstance(tags, dict):
+        return [{'Key': key, 'Value': value} for key, value in sorted(tags.items())]
+    return list(tags)
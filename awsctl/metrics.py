@@ -0,0 +1,255 @@
+#
+# Purpose :     Per API call latency, retry, throttling and size metrics
+#               collected through botocore events
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+import os
+import sys
+import json
+import time
+import atexit
+import bisect
+import threading
+from functools import partial
+
+## upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+THROTTLING_ERRORS = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                     'RequestThrottled', 'RequestThrottledException', 'SlowDown')
+## keys of the request context where before-call leaves the start time and the
+## operation, after-call-error is only given the context
+CONTEXT_KEY = 'awsctl_metrics_start'
+CONTEXT_OPERATION = 'awsctl_metrics_operation'
+
+
+def errorCode(parsed):
+    if isinstance(parsed, dict):
+        return parsed.get('Error', {}).get('Code')
+    return None
+
+
+class OperationStats(object):
+
+    __slots__ = ('calls', 'errors', 'throttled', 'retries', 'bytes', 'seconds', 'maxSeconds', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.retries = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.maxSeconds = 0.0
+        ## last bucket counts the calls slower than the last bound
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        self.maxSeconds = max(self.maxSeconds, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    ## upper bound of the bucket holding the given quantile
+    def quantile(self, q):
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(LATENCY_BUCKETS[i], self.maxSeconds) if i < len(LATENCY_BUCKETS) else self.maxSeconds
+        return self.maxSeconds
+
+    def toDict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 6),
+            "max_seconds": round(self.maxSeconds, 6),
+            "p50_seconds": self.quantile(0.5),
+            "p95_seconds": self.quantile(0.95),
+            "buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], self.buckets)),
+        }
+
+
+## Collects metrics of every client it instruments, keyed by (service, operation, region).
+## Handlers run on the worker threads issuing the calls, so updates happen under a lock.
+## busySeconds is the wall time with at least one call in flight, comparing it with the
+## run time tells whether a run was waiting on Aws or on local work.
+class Metrics(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._inFlight = 0
+        self._busySince = None
+        self.busySeconds = 0.0
+        self.started = time.time()
+
+    def instrument(self, client):
+        service = client.meta.service_model.service_name
+        region = client.meta.region_name or "global"
+        events = client.meta.events
+        events.register('before-call', self._beforeCall)
+        events.register('after-call', partial(self._afterCall, service, region))
+        events.register('after-call-error', partial(self._afterCallError, service, region))
+        events.register('needs-retry', partial(self._needsRetry, service, region))
+        return client
+
+    def _get(self, service, operation, region):
+        key = (service, operation, region)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = OperationStats()
+        return stats
+
+    def _beforeCall(self, model=None, context=None, **kwargs):
+        now = time.time()
+        if context is not None:
+            context[CONTEXT_KEY] = now
+            if model is not None:
+                context[CONTEXT_OPERATION] = model.name
+        with self._lock:
+            if self._inFlight == 0:
+                self._busySince = now
+            self._inFlight += 1
+
+    def _finish(self, service, model, region, context):
+        now = time.time()
+        context = context or {}
+        started = context.get(CONTEXT_KEY, now)
+        operation = model.name if model else context.get(CONTEXT_OPERATION, "unknown")
+        with self._lock:
+            self._inFlight = max(0, self._inFlight - 1)
+            if self._inFlight == 0 and self._busySince is not None:
+                self.busySeconds += now - self._busySince
+                self._busySince = None
+            stats = self._get(service, operation, region)
+            stats.observe(now - started)
+        return stats
+
+    def _afterCall(self, service, region, http_response=None, parsed=None, model=None, context=None, **kwargs):
+        received = 0
+        if http_response is not None:
+            length = http_response.headers.get('content-length')
+            if length is not None:
+                received = int(length)
+            elif http_response.raw is not None and (model is None or not model.has_streaming_output):
+                received = len(http_response.content or b'')
+        metadata = parsed.get('ResponseMetadata', {}) if isinstance(parsed, dict) else {}
+        stats = self._finish(service, model, region, context)
+        with self._lock:
+            stats.bytes += received
+            stats.retries += metadata.get('RetryAttempts', 0)
+            if http_response is not None and http_response.status_code >= 300:
+                stats.errors += 1
+
+    def _afterCallError(self, service, region, context=None, **kwargs):
+        stats = self._finish(service, None, region, context)
+        with self._lock:
+            stats.errors += 1
+
+    ## emitted once per attempt, including throttled attempts that end up retried
+    def _needsRetry(self, service, region, response=None, operation=None, **kwargs):
+        if response is None or errorCode(response[1]) not in THROTTLING_ERRORS:
+            return None
+        with self._lock:
+            self._get(service, operation.name if operation else "unknown", region).throttled += 1
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            busy = self.busySeconds
+            if self._busySince is not None:
+                busy += time.time() - self._busySince
+            stats = sorted((key, value.toDict()) for key, value in self._stats.items())
+        return time.time() - self.started, busy, stats
+
+    def toJson(self):
+        elapsed, busy, stats = self.snapshot()
+        return {
+            "elapsed_seconds": round(elapsed, 6),
+            "busy_seconds": round(busy, 6),
+            "operations": [dict(service=service, operation=operation, region=region, **values)
+                           for (service, operation, region), values in stats],
+        }
+
+    ## Prometheus text exposition format, suitable for the node exporter textfile collector
+    def toPrometheus(self):
+        elapsed, busy, stats = self.snapshot()
+        lines = [
+            "# HELP awsctl_run_seconds Wall time of the run",
+            "# TYPE awsctl_run_seconds gauge",
+            "awsctl_run_seconds %f" %(elapsed),
+            "# HELP awsctl_api_busy_seconds Wall time with at least one Aws call in flight",
+            "# TYPE awsctl_api_busy_seconds gauge",
+            "awsctl_api_busy_seconds %f" %(busy),
+        ]
+        counters = (("calls", "Aws API calls"), ("errors", "Aws API calls that failed"),
+                    ("throttled", "Throttled Aws API attempts"), ("retries", "Retried Aws API attempts"),
+                    ("bytes", "Bytes received from Aws"))
+        for name, description in counters:
+            lines.append("# HELP awsctl_api_%s_total %s" %(name, description))
+            lines.append("# TYPE awsctl_api_%s_total counter" %(name))
+            for (service, operation, region), values in stats:
+                lines.append('awsctl_api_%s_total{service="%s",operation="%s",region="%s"} %d'
+                             %(name, service, operation, region, values[name]))
+        lines.append("# HELP awsctl_api_latency_seconds Latency of Aws API calls")
+        lines.append("# TYPE awsctl_api_latency_seconds histogram")
+        for (service, operation, region), values in stats:
+            labels = 'service="%s",operation="%s",region="%s"' %(service, operation, region)
+            cumulative = 0
+            for bound, count in values["buckets"].items():
+                cumulative += count
+                lines.append('awsctl_api_latency_seconds_bucket{%s,le="%s"} %d' %(labels, bound, cumulative))
+            lines.append('awsctl_api_latency_seconds_sum{%s} %f' %(labels, values["seconds"]))
+            lines.append('awsctl_api_latency_seconds_count{%s} %d' %(labels, values["calls"]))
+        return "\n".join(lines) + "\n"
+
+    def toTable(self):
+        elapsed, busy, stats = self.snapshot()
+        rows = [("Service", "Operation", "Region", "Calls", "Errors", "Throttled", "Retries", "Bytes", "p50", "p95", "Max", "Total")]
+        for (service, operation, region), values in stats:
+            rows.append((service, operation, region, str(values["calls"]), str(values["errors"]),
+                         str(values["throttled"]), str(values["retries"]), str(values["bytes"]),
+                         "%.3f" %(values["p50_seconds"]), "%.3f" %(values["p95_seconds"]),
+                         "%.3f" %(values["max_seconds"]), "%.3f" %(values["seconds"])))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+        lines.append("")
+        lines.append("Run time %.3fs, Aws calls in flight %.3fs, local work %.3fs"
+                     %(elapsed, busy, max(0.0, elapsed - busy)))
+        return "\n".join(lines) + "\n"
+
+    ## target is "-" for a table on stderr, or a path whose extension selects json or prom
+    def write(self, target):
+        if target in (None, "-"):
+            sys.stderr.write(self.toTable())
+            return
+        if target.endswith(".json"):
+            content = json.dumps(self.toJson(), indent=2) + "\n"
+        elif target.endswith(".prom"):
+            content = self.toPrometheus()
+        else:
+            content = self.toTable()
+        ## the textfile collector may read at any time, so the file is replaced atomically
+        tmp = "%s.%d.tmp" %(target, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(content)
+        os.replace(tmp, target)
+
+
+## instrument every client created from now on and report at exit
+def enableMetrics(target="-", registry=None):
+    if registry is None:
+        from awsctl.clients import registry
+    metrics = Metrics()
+    registry.metrics = metrics
+    atexit.register(metrics.write, target)
+    return metrics
@@ -0,0 +1,72 @@
+#
+# Purpose :     Buffered tsv/csv/jsonl writer shared by the list actions
+# Author:       Ivan Martinez
+# Dependencies: python3
+#
+
+import csv
+import io
+import json
+import sys
+
+OUTPUT_FORMATS = ('tsv', 'csv', 'jsonl')
+DEFAULT_OUTPUT = 'tsv'
+## characters buffered before writing a block to the stream
+DEFAULT_BUFFER_SIZE = 1 << 16
+
+
+## Write rows (tuples following columns) in tsv, csv or jsonl, keeping only
+## the column indexes in fields. Rows are collected in memory and written to
+## the stream in blocks of about bufferSize characters.
+class RecordWriter(object):
+
+    def __init__(self, columns, fields=None, fmt=DEFAULT_OUTPUT, stream=None, bufferSize=DEFAULT_BUFFER_SIZE):
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError("Unknown output %s, valid outputs are: %s" %(fmt, ", ".join(OUTPUT_FORMATS)))
+        self.columns = columns
+        self.fields = fields if fields is not None else list(range(len(columns)))
+        self.names = [columns[i] for i in self.fields]
+        self.fmt = fmt
+        self.stream = stream
+        self.bufferSize = bufferSize
+        self.buffer = io.StringIO()
+        self.csv = csv.writer(self.buffer, lineterminator="\n")
+
+    ## column names, jsonl has no header line
+    def header(self):
+        if self.fmt == 'tsv':
+            self.buffer.write("\t".join(self.names) + "\n")
+        elif self.fmt == 'csv':
+            self.csv.writerow(self.names)
+
+    def write(self, row):
+        values = [row[i] for i in self.fields]
+        if self.fmt == 'tsv':
+            self.buffer.write("\t".join(_tsvValue(value) for value in values) + "\n")
+        elif self.fmt == 'csv':
+            self.csv.writerow(values)
+        else:
+            self.buffer.write(json.dumps(dict(zip(self.names, values)), default=str) + "\n")
+
+        if self.buffer.tell() >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        stream = self.stream or sys.stdout
+        stream.write(self.buffer.getvalue())
+        stream.flush()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    ## every row is printed as it comes, there are no previous rows to keep,
+    ## see snapshot.DiffWriter.keep
+    def keep(self, column=None, values=()):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+## tabs and new lines inside a value would break the tsv columns
+def _tsvValue(value):
+    return str(value).replace("\t", " ").replace("\n", " ")
@@ -0,0 +1,24 @@
+#
+# Purpose :     Stream records from boto3 list/describe calls page by page
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+import jmespath
+
+DEFAULT_PAGE_SIZE = 500
+
+
+## Yield the records selected by expression (ej: 'Reservations[].Instances[]')
+## from every page of operation. Only one page is held in memory at a time.
+## Operations without a paginator (ej: describe_addresses) are called once.
+def paginate(client, operation, expression, pageSize=DEFAULT_PAGE_SIZE, **kwargs):
+    if client.can_paginate(operation):
+        paginator = client.get_paginator(operation)
+        pages = paginator.paginate(PaginationConfig={'PageSize': pageSize}, **kwargs)
+        for record in pages.search(expression):
+            yield record
+    else:
+        response = getattr(client, operation)(**kwargs)
+        for record in jmespath.search(expression, response) or []:
+            yield record
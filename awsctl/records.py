@@ -0,0 +1,135 @@
+#
+# Purpose :     Compact record types built from boto3 responses
+# Author:       Ivan Martinez
+# Dependencies: python3
+#
+
+from awsctl.exposure import Rule, groupRules, internString
+
+UNDEFINED_NAME = "Undefined"
+
+
+## ((key, value), ...) of a boto3 tag list, keys are interned as they repeat a lot
+def tagPairs(tags):
+    return tuple((internString(tag.get('Key')), tag.get('Value')) for tag in tags or ())
+
+
+def tagValue(tags, key, default=None):
+    for tagKey, value in tags:
+        if tagKey == key:
+            return value
+    return default
+
+
+## The records keep only the fields the scripts print or join on, in __slots__
+## and with the strings repeated across records interned, so a whole multi-region
+## inventory fits in a fraction of the memory of the boto3 dicts. fromResponse
+## builds a record from one item of a response page; callers converting pages as
+## they stream let the raw dicts be freed right away.
+class Instance(object):
+
+    __slots__ = ('region', 'id', 'name', 'type', 'state', 'privateIp', 'publicIp', 'vpcId', 'tags')
+
+    def __init__(self, region, id, name, type, state, privateIp, publicIp, vpcId, tags):
+        self.region = internString(region)
+        self.id = id
+        self.name = name
+        self.type = internString(type)
+        self.state = internString(state)
+        self.privateIp = privateIp
+        self.publicIp = publicIp
+        self.vpcId = internString(vpcId)
+        self.tags = tags
+
+    @classmethod
+    def fromResponse(cls, region, instance):
+        tags = tagPairs(instance.get('Tags'))
+        return cls(region, instance.get("InstanceId", "NULL"), tagValue(tags, 'Name', UNDEFINED_NAME),
+                   instance.get("InstanceType", "NULL"), (instance.get('State') or {}).get('Name'),
+                   instance.get("PrivateIpAddress", "NULL"), instance.get("PublicIpAddress", "NULL"),
+                   instance.get("VpcId"), tags)
+
+    ## values of the COLUMNS of aws-ec2-instance.py
+    def row(self):
+        return (self.region, self.name, self.id, self.type, self.state, self.privateIp, self.publicIp)
+
+
+class ElasticIP(object):
+
+    __slots__ = ('region', 'allocationId', 'name', 'publicIp', 'domain', 'associationId', 'instanceId',
+                 'interfaceId', 'privateIp', 'tags')
+
+    def __init__(self, region, allocationId, name, publicIp, domain, associationId, instanceId, interfaceId, privateIp, tags):
+        self.region = internString(region)
+        self.allocationId = allocationId
+        self.name = name
+        self.publicIp = publicIp
+        self.domain = internString(domain)
+        self.associationId = associationId
+        self.instanceId = instanceId
+        self.interfaceId = interfaceId
+        self.privateIp = privateIp
+        self.tags = tags
+
+    @classmethod
+    def fromResponse(cls, region, eip):
+        tags = tagPairs(eip.get('Tags'))
+        return cls(region, eip.get("AllocationId"), tagValue(tags, 'Name', UNDEFINED_NAME), eip.get("PublicIp"),
+                   eip.get("Domain"), eip.get("AssociationId"), eip.get("InstanceId"), eip.get("NetworkInterfaceId"),
+                   eip.get("PrivateIpAddress"), tags)
+
+    ## values of the COLUMNS of aws-ec2-elastic-ips.py
+    def row(self):
+        return (self.region, self.name, self.allocationId, self.publicIp, self.domain, self.associationId,
+                self.instanceId, self.interfaceId, self.privateIp)
+
+
+class SecurityGroup(object):
+
+    __slots__ = ('region', 'id', 'name', 'vpcId', 'rules', 'tags')
+
+    def __init__(self, region, id, name, vpcId, rules, tags):
+        self.region = internString(region)
+        self.id = id
+        self.name = name
+        self.vpcId = internString(vpcId)
+        self.rules = rules
+        self.tags = tags
+
+    @classmethod
+    def fromResponse(cls, region, secgroup):
+        groupId = secgroup.get("GroupId", "NULL")
+        name = secgroup.get('GroupName')
+        rules = tuple(Rule(region, groupId, name, direction, protocol, fromPort, toPort, peer, description)
+                      for direction, protocol, fromPort, toPort, peer, description in groupRules(secgroup))
+        return cls(region, groupId, name, secgroup.get("VpcId", "NULL"), rules, tagPairs(secgroup.get('Tags')))
+
+    ## values of the COLUMNS of aws-ec2-security-groups.py
+    def row(self):
+        return (self.region, self.name, self.id, self.vpcId)
+
+
+class IAMUser(object):
+
+    __slots__ = ('id', 'name', 'arn', 'createDate', 'tags')
+
+    def __init__(self, id, name, arn, createDate, tags):
+        self.id = id
+        self.name = name
+        self.arn = arn
+        self.createDate = createDate
+        self.tags = tags
+
+    @classmethod
+    def fromResponse(cls, region, user):
+        return cls(user.get("UserId"), user.get("UserName"), user.get('Arn'), user.get("CreateDate"), tagPairs(user.get('Tags')))
+
+    ## values of the COLUMNS of aws-iam-list-users.py
+    def row(self):
+        return (self.name, self.id, self.arn, self.createDate)
+
+
+## Stream of records of recordClass from a stream of response items of region
+def fromResponses(recordClass, region, items):
+    for item in items:
+        yield recordClass.fromResponse(region, item)
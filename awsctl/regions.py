@@ -0,0 +1,114 @@
+#
+# Purpose :     Run per-region work concurrently and stream results in order
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import queue
+import threading
+from awsctl.cache import readCache, writeCache, removeCache
+
+DEFAULT_WORKERS = 8
+## seconds a cached region list is trusted before calling describe_regions again.
+## A region opted in meanwhile is not seen until it expires, so it is kept short.
+DEFAULT_REGION_TTL = 3600
+## error codes returned by regions that are not enabled for the account anymore
+OPT_OUT_ERRORS = ('AuthFailure', 'OptInRequired', 'UnrecognizedClientException')
+## number of records a region may buffer ahead of the region being printed
+DEFAULT_QUEUE_SIZE = 1000
+
+_ITEM = 0
+_ERROR = 1
+_DONE = 2
+
+
+## put an item in a region queue, giving up if the consumer went away
+def _put(regionQueue, entry, stop):
+    while not stop.is_set():
+        try:
+            regionQueue.put(entry, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _runRegion(region, func, regionQueue, stop, onError):
+    try:
+        for item in func(region):
+            if not _put(regionQueue, (_ITEM, item), stop):
+                return
+    except Exception as e:
+        if onError is not None:
+            onError(region, e)
+        _put(regionQueue, (_ERROR, e), stop)
+    _put(regionQueue, (_DONE, None), stop)
+
+
+## Call func(region) for every region using a bounded thread pool.
+## func must return an iterable; its items are yielded as (region, item)
+## following the order of the regions argument, so output stays deterministic.
+## A failure in one region is logged, passed to onError(region, exception)
+## when given, appended to the failed list when given, and does not stop the others.
+def runRegions(regions, func, workers=DEFAULT_WORKERS, queueSize=DEFAULT_QUEUE_SIZE, onError=None, failed=None):
+    regions = list(regions)
+    if workers < 1:
+        workers = 1
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queueSize) for _ in regions]
+    executor = ThreadPoolExecutor(max_workers=min(workers, max(len(regions), 1)))
+
+    try:
+        for region, regionQueue in zip(regions, queues):
+            executor.submit(_runRegion, region, func, regionQueue, stop, onError)
+
+        for region, regionQueue in zip(regions, queues):
+            while True:
+                kind, value = regionQueue.get()
+                if kind == _ITEM:
+                    yield region, value
+                elif kind == _ERROR:
+                    logging.error("Failed to process region %s: %s" %(region, value))
+                    if failed is not None:
+                        failed.append(region)
+                else:
+                    break
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+
+def _regionCacheName(profile):
+    return "regions-%s.json" %(profile or "default")
+
+
+## Names of the regions enabled for the profile, from the on-disk cache when it
+## is younger than ttl seconds, otherwise from describe_regions of client.
+def getRegions(client, profile, ttl=DEFAULT_REGION_TTL, refresh=False):
+    name = _regionCacheName(profile)
+    if not refresh:
+        regions = readCache(name, ttl)
+        if regions:
+            return regions
+
+    regions = sorted(reg['RegionName'] for reg in client.describe_regions()['Regions'])
+    writeCache(name, regions)
+    return regions
+
+
+def invalidateRegions(profile):
+    removeCache(_regionCacheName(profile))
+
+
+## onError callback for runRegions that drops the cached region list when a
+## region answers as not enabled, so the next run picks up the opt-out. A new
+## opt-in raises no error, it is picked up when the cache expires.
+def invalidateOnOptOut(profile):
+    def onError(region, error):
+        code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+        if code in OPT_OUT_ERRORS:
+            logging.warning("Region %s is not enabled, region cache invalidated." %(region))
+            invalidateRegions(profile)
+    return onError
@@ -0,0 +1,123 @@
+#
+# Purpose :     Graph of security groups referencing other security groups
+# Author:       Ivan Martinez
+# Dependencies: python3
+#
+
+from collections import deque
+import json
+from awsctl.exposure import groupRules, normalizeProtocol, portRange, allowsPorts, ALL_PORTS
+
+GRAPH_FORMATS = ('json', 'dot')
+
+
+## Parse a port set like 22,443,8000-8080 into a list of (from, to) ranges
+def parsePorts(ports):
+    ranges = []
+    for item in (ports or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        first, _, last = item.partition("-")
+        ranges.append((int(first), int(last or first)))
+    return ranges
+
+
+## Directed graph where an edge X -> Y means a rule of X (outbound) or of Y
+## (inbound) lets members of X send traffic to members of Y. Security groups
+## are added one by one while pages stream, so the graph is built in one pass.
+class GroupGraph(object):
+
+    def __init__(self):
+        self.nodes = {}
+        self.edges = {}
+
+    def _node(self, nodeId, **attributes):
+        node = self.nodes.setdefault(nodeId, {'id': nodeId, 'type': 'prefix-list' if nodeId.startswith("pl-") else 'security-group'})
+        node.update((key, value) for key, value in attributes.items() if value is not None)
+
+    def _edge(self, source, target, protocol, fromPort, toPort):
+        protocol = normalizeProtocol(protocol)
+        ports = portRange(protocol, fromPort, toPort)
+        self.edges.setdefault(source, {}).setdefault(target, set()).add((protocol or "all", ports[0], ports[1]))
+
+    def addGroup(self, region, secgroup):
+        groupId = secgroup.get('GroupId')
+        self._node(groupId, region=region, name=secgroup.get('GroupName'), vpc=secgroup.get('VpcId'))
+
+        for direction, protocol, from_port, to_port, peer, desc in groupRules(secgroup):
+            if not peer or not (peer.startswith("sg-") or peer.startswith("pl-")):
+                continue
+            self._node(peer)
+            if direction == "inbound":
+                self._edge(peer, groupId, protocol, from_port, to_port)
+            else:
+                self._edge(groupId, peer, protocol, from_port, to_port)
+
+    ## True when one of the (protocol, from, to) rules of an edge covers one of the port ranges
+    @staticmethod
+    def _allows(rules, portRanges, protocol):
+        for ruleProtocol, fromPort, toPort in rules:
+            if protocol is not None and ruleProtocol not in ("all", protocol):
+                continue
+            if not portRanges:
+                return True
+            ## icmp edges carry no ports, they never open the port ranges
+            if not allowsPorts(None if ruleProtocol == "all" else ruleProtocol):
+                continue
+            for first, last in portRanges:
+                if fromPort <= last and first <= toPort:
+                    return True
+        return False
+
+    ## Breadth first search from start following only the edges open on the
+    ## port ranges, returns {node id: hops}
+    def reachable(self, start, portRanges=None, protocol=None):
+        protocol = normalizeProtocol(protocol) if protocol is not None else None
+        hops = {start: 0}
+        pending = deque([start])
+        while pending:
+            nodeId = pending.popleft()
+            for target, rules in self.edges.get(nodeId, {}).items():
+                if target not in hops and self._allows(rules, portRanges, protocol):
+                    hops[target] = hops[nodeId] + 1
+                    pending.append(target)
+        return hops
+
+    ## Nodes and edges restricted to the given node ids, all of them by default,
+    ## and to the rules open on the port ranges and protocol when they are given
+    def _subgraph(self, nodeIds=None, portRanges=None, protocol=None):
+        protocol = normalizeProtocol(protocol) if protocol is not None else None
+        nodeIds = set(self.nodes) if nodeIds is None else set(nodeIds)
+        nodes = [self.nodes[nodeId] for nodeId in sorted(nodeIds) if nodeId in self.nodes]
+        edges = []
+        for source in sorted(self.edges):
+            if source not in nodeIds:
+                continue
+            for target in sorted(self.edges[source]):
+                if target in nodeIds:
+                    for rule in sorted(self.edges[source][target]):
+                        if self._allows((rule,), portRanges, protocol):
+                            edges.append({'source': source, 'target': target, 'protocol': rule[0], 'fromPort': rule[1], 'toPort': rule[2]})
+        return nodes, edges
+
+    def toJson(self, nodeIds=None, hops=None, portRanges=None, protocol=None):
+        nodes, edges = self._subgraph(nodeIds, portRanges, protocol)
+        graph = {'nodes': nodes, 'edges': edges}
+        if hops is not None:
+            graph['reachable'] = hops
+        return json.dumps(graph, indent=2, sort_keys=True)
+
+    def toDot(self, nodeIds=None, hops=None, portRanges=None, protocol=None):
+        nodes, edges = self._subgraph(nodeIds, portRanges, protocol)
+        lines = ["digraph securitygroups {"]
+        for node in nodes:
+            label = "%s\\n%s" %(node['id'], node.get('name', ""))
+            if hops is not None and node['id'] in hops:
+                label += "\\nhops=%d" %(hops[node['id']])
+            lines.append('  "%s" [label="%s"%s];' %(node['id'], label, ', shape=box' if node['type'] == 'prefix-list' else ""))
+        for edge in edges:
+            ports = "all" if (edge['fromPort'], edge['toPort']) == ALL_PORTS else "%s-%s" %(edge['fromPort'], edge['toPort'])
+            lines.append('  "%s" -> "%s" [label="%s/%s"];' %(edge['source'], edge['target'], edge['protocol'], ports))
+        lines.append("}")
+        return "\n".join(lines)
@@ -0,0 +1,150 @@
+#
+# Purpose :     Compact snapshots of printed records and the diff against them
+# Author:       Ivan Martinez
+# Dependencies: python3
+#
+
+import hashlib
+import json
+import logging
+import os
+import struct
+import zlib
+
+from awsctl.output import RecordWriter
+
+SNAPSHOT_MAGIC = b"AWSCTLS2"
+## snapshots hashing repr() of the values, before they were normalized
+OLD_SNAPSHOT_MAGICS = (b"AWSCTLS1",)
+HASH_SIZE = 8
+## separates the values of a composite key
+KEY_SEPARATOR = "\x1f"
+CHANGE_COLUMN = "Change"
+CHANGED_FIELDS_COLUMN = "Changed Fields"
+
+
+## stable fingerprint of one value. Values are hashed as str so a record hashes
+## the same live and from the local inventory, where a datetime is stored as its
+## str; None gets a marker no str can produce.
+def valueHash(value):
+    data = b"\x00" if value is None else b"\x01" + str(value).encode()
+    return hashlib.blake2b(data, digest_size=HASH_SIZE).digest()
+
+
+def rowHashes(row):
+    return b"".join(valueHash(value) for value in row)
+
+
+## Snapshot file: magic, then zlib compressed json header line followed by one
+## entry per record: key length, utf-8 key and one hash per column.
+## Only hashes are kept, so a snapshot of 100k instances is a few megabytes.
+def writeSnapshot(path, columns, keyColumns, records):
+    body = bytearray(json.dumps({"columns": list(columns), "keys": list(keyColumns), "count": len(records)}).encode() + b"\n")
+    for key, hashes in records.items():
+        encoded = key.encode()
+        body += struct.pack(">H", len(encoded))
+        body += encoded
+        body += hashes
+    tmppath = "%s.%d.tmp" %(path, os.getpid())
+    with open(tmppath, "wb") as snapshot:
+        snapshot.write(SNAPSHOT_MAGIC)
+        snapshot.write(zlib.compress(bytes(body)))
+    os.replace(tmppath, path)
+
+
+## key -> hashes of a snapshot taken with the same columns, empty when there is none
+def readSnapshot(path, columns, keyColumns):
+    try:
+        with open(path, "rb") as snapshot:
+            data = snapshot.read()
+    except FileNotFoundError:
+        return {}
+    if data[:len(SNAPSHOT_MAGIC)] in OLD_SNAPSHOT_MAGICS:
+        logging.warning("Snapshot %s was taken by an older version, every record is reported as added" %(path))
+        return {}
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise ValueError("%s is not a snapshot" %(path))
+    try:
+        body = zlib.decompress(data[len(SNAPSHOT_MAGIC):])
+        end = body.index(b"\n")
+        header = json.loads(body[:end].decode())
+    except (zlib.error, ValueError):
+        raise ValueError("Snapshot %s is corrupt" %(path))
+    if header["columns"] != list(columns) or header["keys"] != list(keyColumns):
+        logging.warning("Snapshot %s was taken with other columns, every record is reported as added" %(path))
+        return {}
+
+    records = {}
+    size = HASH_SIZE * len(columns)
+    offset = end + 1
+    for _ in range(header["count"]):
+        length, = struct.unpack_from(">H", body, offset)
+        offset += 2
+        key = body[offset:offset + length].decode()
+        offset += length
+        records[key] = body[offset:offset + size]
+        offset += size
+    return records
+
+
+## Drop-in replacement of RecordWriter printing only the rows added, modified or
+## removed since the snapshot at path, which is then replaced by the current rows.
+## Rows are identified by keyColumns, modified rows list the columns that changed
+## and removed rows only carry their key.
+class DiffWriter(object):
+
+    def __init__(self, writer, keyColumns, path):
+        self.columns = writer.columns
+        self.keyColumns = tuple(keyColumns)
+        self.keyIndexes = [self.columns.index(column) for column in keyColumns]
+        self.path = path
+        columns = (CHANGE_COLUMN,) + tuple(self.columns) + (CHANGED_FIELDS_COLUMN,)
+        fields = [0] + [i + 1 for i in writer.fields] + [len(columns) - 1]
+        self.output = RecordWriter(columns, fields, writer.fmt, writer.stream, writer.bufferSize)
+        self.previous = readSnapshot(path, self.columns, self.keyColumns)
+        self.current = {}
+
+    def key(self, row):
+        return KEY_SEPARATOR.join(str(row[i]) for i in self.keyIndexes)
+
+    def header(self):
+        self.output.header()
+
+    def write(self, row):
+        key = self.key(row)
+        hashes = rowHashes(row)
+        self.current[key] = hashes
+        previous = self.previous.get(key)
+        if previous is None:
+            self.output.write(("added",) + tuple(row) + ("",))
+        elif previous != hashes:
+            changed = [column for i, column in enumerate(self.columns)
+                       if previous[i * HASH_SIZE:(i + 1) * HASH_SIZE] != hashes[i * HASH_SIZE:(i + 1) * HASH_SIZE]]
+            self.output.write(("modified",) + tuple(row) + (",".join(changed),))
+
+    ## Keep the rows of the snapshot whose column is one of values, ej: the
+    ## regions that failed during the run, instead of reporting them as removed.
+    ## Without a column every row of the snapshot not written again is kept.
+    def keep(self, column=None, values=()):
+        if column is not None:
+            index = self.columns.index(column)
+            hashes = set(valueHash(value) for value in values)
+        for key, previous in self.previous.items():
+            if key in self.current:
+                continue
+            if column is None or previous[index * HASH_SIZE:(index + 1) * HASH_SIZE] in hashes:
+                self.current[key] = previous
+
+    def flush(self):
+        self.output.flush()
+
+    def close(self):
+        for key in self.previous:
+            if key not in self.current:
+                row = [""] * len(self.columns)
+                for index, value in zip(self.keyIndexes, key.split(KEY_SEPARATOR)):
+                    row[index] = value
+                self.output.write(("removed",) + tuple(row) + ("",))
+        self.output.close()
+        writeSnapshot(self.path, self.columns, self.keyColumns, self.current)
+        logging.info("Snapshot %s updated with %d records" %(self.path, len(self.current)))
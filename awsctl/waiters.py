@@ -0,0 +1,63 @@
+#
+# Purpose :     Track many instances at once until they reach a target state
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+import time
+
+DEFAULT_POLL_INTERVAL = 15
+DEFAULT_TIMEOUT = 1800
+## instance ids accepted by one start_instances/stop_instances call
+MAX_ACTION_IDS = 1000
+## instance ids accepted by one describe_instance_status call
+MAX_STATUS_IDS = 100
+## states an instance can not come back from while starting or stopping
+FAILED_STATES = ('shutting-down', 'terminated')
+
+
+def chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+## same condition as the system_status_ok waiter
+def systemStatusOk(status):
+    return status['InstanceState']['Name'] == 'running' and status.get('SystemStatus', {}).get('Status') == 'ok'
+
+
+## same condition as the instance_stopped waiter
+def instanceStopped(status):
+    return status['InstanceState']['Name'] == 'stopped'
+
+
+## Poll describe_instance_status for all instanceIds together, in as few calls
+## as possible, and yield (instance id, state, reached) as soon as an instance
+## reaches target(status), fails or the timeout expires.
+def waitInstances(client, instanceIds, target, interval=DEFAULT_POLL_INTERVAL, timeout=DEFAULT_TIMEOUT):
+    pending = set(instanceIds)
+    deadline = time.time() + timeout
+
+    while pending:
+        for chunk in chunks(sorted(pending), MAX_STATUS_IDS):
+            response = client.describe_instance_status(InstanceIds=chunk, IncludeAllInstances=True)
+            for status in response['InstanceStatuses']:
+                iid = status['InstanceId']
+                state = status['InstanceState']['Name']
+                if iid not in pending:
+                    continue
+                if target(status):
+                    pending.discard(iid)
+                    yield iid, state, True
+                elif state in FAILED_STATES:
+                    pending.discard(iid)
+                    yield iid, state, False
+
+        if not pending:
+            break
+        if time.time() >= deadline:
+            for iid in sorted(pending):
+                yield iid, "timeout", False
+            return
+        time.sleep(interval)
@@ -0,0 +1,74 @@
+#
+# Purpose :     Watch the state of many instances across regions at once
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+import time
+from awsctl.regions import runRegions, DEFAULT_WORKERS
+
+DEFAULT_MIN_INTERVAL = 5
+DEFAULT_MAX_INTERVAL = 60
+## lowest interval a region is polled at, 0 would poll in a busy loop
+MIN_INTERVAL = 1
+THROTTLING_ERRORS = ('RequestLimitExceeded', 'Throttling', 'ThrottlingException')
+
+
+## (instance state, system status, instance status) of a describe_instance_status record
+def statusKey(status):
+    return (status['InstanceState']['Name'],
+            status.get('SystemStatus', {}).get('Status', "NULL"),
+            status.get('InstanceStatus', {}).get('Status', "NULL"))
+
+
+## Poll every region with poll(region), which returns a stream of
+## describe_instance_status records, and call onChange(region, instance id, old, new)
+## only when the statusKey of an instance changes. Each region has its own
+## interval: it doubles up to maxInterval while nothing changes or the region
+## is throttled, and goes back to minInterval as soon as something changes.
+## Intervals are at least MIN_INTERVAL seconds. Returns True when every watched
+## instance reached the until state, False on timeout.
+def watchInstances(regions, poll, onChange, minInterval=DEFAULT_MIN_INTERVAL, maxInterval=DEFAULT_MAX_INTERVAL,
+                   timeout=None, until=None, workers=DEFAULT_WORKERS):
+    regions = list(regions)
+    minInterval = max(minInterval, MIN_INTERVAL)
+    maxInterval = max(maxInterval, minInterval)
+    intervals = dict((region, minInterval) for region in regions)
+    nextPoll = dict((region, 0) for region in regions)
+    states = {}
+    throttled = set()
+    deadline = time.time() + timeout if timeout else None
+
+    def onError(region, error):
+        if getattr(error, 'response', {}).get('Error', {}).get('Code') in THROTTLING_ERRORS:
+            throttled.add(region)
+
+    while regions:
+        now = time.time()
+        due = [region for region in regions if nextPoll[region] <= now]
+        changed = set()
+
+        for region, status in runRegions(due, poll, workers, onError=onError):
+            key = (region, status['InstanceId'])
+            new = statusKey(status)
+            old = states.get(key)
+            if old != new:
+                states[key] = new
+                changed.add(region)
+                onChange(region, status['InstanceId'], old, new)
+
+        for region in due:
+            if region in changed and region not in throttled:
+                intervals[region] = minInterval
+            else:
+                intervals[region] = min(intervals[region] * 2, maxInterval)
+            nextPoll[region] = now + intervals[region]
+        throttled.clear()
+
+        if until is not None and states and all(state[0] == until for state in states.values()):
+            return True
+        if deadline is not None and time.time() >= deadline:
+            return False
+        time.sleep(max(0, min(nextPoll.values()) - time.time()))
+
+    return until is None
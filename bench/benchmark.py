@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+#
+# Purpose :     Benchmark the listing paths against a synthetic account, offline
+# Author:       Ivan Martinez
+# Dependencies: python3, boto3
+#
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from itertools import groupby
+from operator import itemgetter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from botocore.awsrequest import AWSResponse
+from awsctl.clients import configureClients, registry
+from awsctl.output import RecordWriter
+from awsctl.regions import runRegions
+
+## real region names so endpoints resolve, --regions is capped to this list
+REGION_NAMES = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'eu-west-1', 'eu-west-2', 'eu-west-3',
+                'eu-central-1', 'eu-north-1', 'ap-south-1', 'ap-northeast-1', 'ap-northeast-2',
+                'ap-northeast-3', 'ap-southeast-1', 'ap-southeast-2', 'ca-central-1', 'sa-east-1']
+
+## case -> (script, module function listing a region, describe printer)
+CASES = {
+    'instances':            ('ec2/aws-ec2-instance.py', 'regionInstanceRecords', 'describeInstances'),
+    'elastic_ips':          ('ec2/aws-ec2-elastic-ips.py', 'regionElasticIPRecords', 'describeElasticIPs'),
+    'security_groups':      ('ec2/aws-ec2-security-groups.py', 'regionSecurityGroupRecords', 'describeSecurityGroups'),
+    'security_group_rules': ('ec2/aws-ec2-security-groups.py', 'regionSecurityGroupRecords', 'describeSecurityGroupRules'),
+    'iam_users':            ('iam/aws-iam-list-users.py', 'iamUserRecords', 'describeIAMUsers'),
+}
+
+DEFAULT_SIZES = "100,10000,100000"
+DEFAULT_STARTUP_RUNS = 10
+
+## name -> command line whose wall time is measured from process start to exit
+STARTUP_COMMANDS = [
+    ('python', ['-c', 'pass']),
+    ('import_boto3', ['-c', 'import boto3']),
+    ('awsctl_help', ['-m', 'awsctl', '-h']),
+    ('awsctl_ec2_instances_help', ['-m', 'awsctl', 'ec2', 'instances', '-h']),
+    ('awsctl_ec2_instances_bad_args', ['-m', 'awsctl', 'ec2', 'instances']),
+    ('script_ec2_instances_help', [os.path.join(ROOT, 'ec2', 'aws-ec2-instance.py'), '-h']),
+]
+DEFAULT_PAGE_SIZE = 1000
+
+
+def fakeInstance(region, index):
+    return {'InstanceId': 'i-%017x' %(index), 'InstanceType': 't3.micro', 'State': {'Code': 16, 'Name': 'running'},
+            'PrivateIpAddress': '10.%d.%d.%d' %(index >> 16 & 255, index >> 8 & 255, index & 255),
+            'PublicIpAddress': '203.0.%d.%d' %(index >> 8 & 255, index & 255), 'VpcId': 'vpc-%08x' %(index % 50),
+            'Placement': {'AvailabilityZone': region + 'a'}, 'Tags': [{'Key': 'Name', 'Value': 'bench-%d' %(index)}, {'Key': 'env', 'Value': 'bench'}]}
+
+
+def fakeAddress(region, index):
+    address = {'AllocationId': 'eipalloc-%017x' %(index), 'PublicIp': '198.51.%d.%d' %(index >> 8 & 255, index & 255),
+               'Domain': 'vpc', 'Tags': [{'Key': 'Name', 'Value': 'bench-%d' %(index)}]}
+    if index % 3:
+        address.update(AssociationId='eipassoc-%017x' %(index), InstanceId='i-%017x' %(index),
+                       NetworkInterfaceId='eni-%017x' %(index), PrivateIpAddress='10.0.%d.%d' %(index >> 8 & 255, index & 255))
+    return address
+
+
+def fakeSecurityGroup(region, index):
+    return {'GroupId': 'sg-%017x' %(index), 'GroupName': 'bench-%d' %(index), 'VpcId': 'vpc-%08x' %(index % 50),
+            'IpPermissions': [
+                {'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22, 'IpRanges': [{'CidrIp': '10.%d.0.0/16' %(index & 255)}], 'Ipv6Ranges': []},
+                {'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}], 'Ipv6Ranges': [{'CidrIpv6': '::/0'}],
+                 'UserIdGroupPairs': [{'GroupId': 'sg-%017x' %(index + 1)}]}],
+            'IpPermissionsEgress': [{'IpProtocol': '-1', 'IpRanges': [{'CidrIp': '0.0.0.0/0'}], 'Ipv6Ranges': []}]}
+
+
+def fakeUser(region, index):
+    return {'UserName': 'bench-%d' %(index), 'UserId': 'AIDA%016X' %(index), 'Path': '/',
+            'Arn': 'arn:aws:iam::123456789012:user/bench-%d' %(index), 'CreateDate': '2020-01-01T00:00:00Z'}
+
+
+## operation -> (record factory, function wrapping a page of records in the response shape)
+OPERATIONS = {
+    'DescribeInstances':      (fakeInstance, lambda records: {'Reservations': [{'ReservationId': 'r-1', 'Instances': [record]} for record in records]}),
+    'DescribeAddresses':      (fakeAddress, lambda records: {'Addresses': records}),
+    'DescribeSecurityGroups': (fakeSecurityGroup, lambda records: {'SecurityGroups': records}),
+    'ListUsers':              (fakeUser, lambda records: {'Users': records}),
+}
+
+
+## In-process fake endpoint: answers every call from the before-call event,
+## generating only the requested page, so nothing leaves the process and the
+## response data never sits in memory as a whole
+class FakeEndpoint(object):
+
+    def __init__(self, perRegion, latency=0.0):
+        self.perRegion = perRegion
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.seconds = 0.0
+
+    def __call__(self, model, params, request_signer=None, **kwargs):
+        start = time.time()
+        if self.latency:
+            time.sleep(self.latency)
+
+        factory, shape = OPERATIONS[model.name]
+        body = params.get('body') or {}
+        token = body.get('NextToken') or body.get('Marker')
+        first = int(token) if token else 0
+        size = int(body.get('MaxResults') or body.get('MaxItems') or self.perRegion)
+        last = min(first + size, self.perRegion)
+        region = request_signer.region_name if request_signer is not None else "global"
+
+        parsed = shape([factory(region, index) for index in range(first, last)])
+        if last < self.perRegion:
+            if model.service_model.service_name == 'iam':
+                parsed.update(IsTruncated=True, Marker=str(last))
+            else:
+                parsed['NextToken'] = str(last)
+        parsed['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RetryAttempts': 0}
+
+        with self.lock:
+            self.calls += 1
+            self.seconds += time.time() - start
+        return AWSResponse(None, 200, {}, None), parsed
+
+
+## Import a script as a module and parse the given command line into it
+def loadScript(path, argv):
+    spec = importlib.util.spec_from_file_location(os.path.basename(path).replace("-", "_")[:-3], os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.args = module.parseArguments(argv)
+    return module
+
+
+def peakRssKb():
+    ## ru_maxrss is in kilobytes on linux and bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+## Run one case in the current process and return its measures
+def runCase(case, resources, regionCount, latency, pageSize, workers):
+    script, listName, describeName = CASES[case]
+    phases = {}
+
+    iam = case == 'iam_users'
+    ## IAM is global, its script has no --workers
+    argv = ['list', '--page-size', str(pageSize)] + ([] if iam else ['--workers', str(workers)])
+    start = time.time()
+    module = loadScript(script, argv)
+    phases['import'] = time.time() - start
+
+    start = time.time()
+    configureClients(None)
+    regions = ['global'] if iam else REGION_NAMES[:max(1, min(regionCount, len(REGION_NAMES)))]
+    perRegion = resources if iam else max(resources // len(regions), 1)
+    endpoint = FakeEndpoint(perRegion, latency)
+    registry.getSession().events.register('before-call.*.*', endpoint)
+    module.profile = None
+    module.filters = []
+    module.recordFilter = None
+    if iam:
+        module.setiamclient()
+    phases['setup'] = time.time() - start
+
+    with open(os.devnull, 'w') as devnull:
+        columns = module.RULE_COLUMNS if describeName == 'describeSecurityGroupRules' else module.COLUMNS
+        module.writer = RecordWriter(columns, stream=devnull)
+        describe = getattr(module, describeName)
+        listRegion = getattr(module, listName)
+
+        start = time.time()
+        module.writer.header()
+        if iam:
+            describe(listRegion('global'))
+        else:
+            results = runRegions(regions, listRegion, workers)
+            for reg, records in groupby(results, key=itemgetter(0)):
+                describe(reg, (record for _, record in records))
+        module.writer.close()
+        phases['list'] = time.time() - start
+
+    phases['api'] = endpoint.seconds
+    total = perRegion * len(regions)
+    return {
+        'case': case, 'resources': total, 'regions': len(regions), 'latency': latency,
+        'page_size': pageSize, 'workers': workers, 'calls': endpoint.calls,
+        'seconds': phases['list'], 'records_per_second': total / phases['list'] if phases['list'] else None,
+        'peak_rss_kb': peakRssKb(), 'phases': phases,
+    }
+
+
+## Run every case and size in its own process so peak RSS is measured per case.
+## A case that fails is recorded with its error and the others still run.
+def runAll(args):
+    results = []
+    env = dict(os.environ, AWS_ACCESS_KEY_ID="bench", AWS_SECRET_ACCESS_KEY="bench", AWS_DEFAULT_REGION="us-east-1")
+    env.pop("AWS_PROFILE", None)
+    for case in args.cases.split(","):
+        for size in args.sizes.split(","):
+            command = [sys.executable, os.path.abspath(__file__), '--run-case', case, '--sizes', size,
+                       '--regions', str(args.regions), '--latency', str(args.latency),
+                       '--page-size', str(args.page_size), '--workers', str(args.workers)]
+            process = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            lines = process.stdout.decode().strip().splitlines()
+            if process.returncode or not lines:
+                errors = process.stderr.decode().strip().splitlines()
+                error = errors[-1] if errors else "exit code %d" %(process.returncode)
+                logging.error("%s %s failed: %s" %(case, size, error))
+                results.append({'case': case, 'resources': int(size), 'failed': True, 'error': error})
+                continue
+            result = json.loads(lines[-1])
+            logging.info("%s %s: %.2fs, %s records/s, %s KB peak RSS" %(case, size, result['seconds'],
+                         int(result['records_per_second'] or 0), result['peak_rss_kb']))
+            results.append(result)
+    return results
+
+
+## Startup time of the command line, the fixed cost paid by every cron or CI call
+def runStartup(runs):
+    results = {}
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    for name, argv in STARTUP_COMMANDS:
+        times = []
+        for _ in range(runs):
+            start = time.time()
+            subprocess.run([sys.executable] + argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.time() - start)
+        times.sort()
+        results[name] = {'runs': runs, 'median_seconds': times[len(times) // 2], 'min_seconds': times[0]}
+        logging.info("startup %s: %.3fs median" %(name, times[len(times) // 2]))
+    return results
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Benchmark the listing paths against a synthetic account')
+    argparser.add_argument('--cases', default=",".join(sorted(CASES)), help='Comma separated cases, default is all: %s' %(", ".join(sorted(CASES))))
+    argparser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma separated number of resources, default is %s' %(DEFAULT_SIZES))
+    argparser.add_argument('--regions', type=int, default=4, help='Number of regions the resources are spread over, default is 4')
+    argparser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every fake API call')
+    argparser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help='Records requested per API call')
+    argparser.add_argument('--workers', type=int, default=8, help='Regions listed in parallel')
+    argparser.add_argument('--output', help='File to write the json results, default is stdout')
+    argparser.add_argument('--startup-runs', type=int, default=DEFAULT_STARTUP_RUNS, help='Runs of each startup command, 0 skips the startup measures')
+    argparser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+
+    if args.run_case:
+        logging.getLogger().setLevel(logging.WARNING)
+        result = runCase(args.run_case, int(args.sizes), args.regions, args.latency, args.page_size, args.workers)
+        print(json.dumps(result))
+        return
+
+    startup = runStartup(args.startup_runs) if args.startup_runs > 0 else {}
+    results = runAll(args)
+    report = json.dumps({'python': sys.version.split()[0], 'startup': startup, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report + "\n")
+    else:
+        print(report)
+    return 1 if any(result.get('failed') for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
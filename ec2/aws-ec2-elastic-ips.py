@@ -6,43 +6,93 @@
 # Dependencies: python3, boto3, Aws cli
 #
 
-import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, BotoCoreError
 import sys
 import argparse
 import json
 import logging
-
-## add default logger config
-logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+## make the shared awsctl helpers importable when running the script directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from awsctl.clients import configureClients, getClient, DEFAULT_MAX_POOL_CONNECTIONS, RETRY_MODES, DEFAULT_RETRY_MODE, DEFAULT_MAX_ATTEMPTS
+from awsctl.metrics import enableMetrics
+from awsctl.daemon import forward
+from awsctl.fanout import fanOut, DEFAULT_ACCOUNT_WORKERS
+from awsctl.snapshot import DiffWriter
+from awsctl.records import ElasticIP, fromResponses
+from awsctl.credentials import DEFAULT_ROLE_NAME
+from awsctl.regions import runRegions, getRegions, invalidateOnOptOut, DEFAULT_WORKERS, DEFAULT_REGION_TTL
+from awsctl.pagination import paginate, DEFAULT_PAGE_SIZE
+from awsctl.output import RecordWriter, OUTPUT_FORMATS, DEFAULT_OUTPUT
+from awsctl.filters import buildFilters, projectFields, tagFilters, inventoryQuery
+from awsctl.manifest import readManifest, parseTags
+from awsctl.inventory import Inventory, inventoryPath, syncRegions, DEFAULT_MAX_AGE
+from itertools import groupby
+from operator import itemgetter
 
 ## First create arguments to work with them
-argparser = argparse.ArgumentParser(description='Perform common instance tasks')
-argparser.add_argument('action', help='Instance action to be performed list/add/associate/disassociate/release')
-argparser.add_argument('-p', '--profile', default="default", help='If no profile provided, assumes default')
-argparser.add_argument('-r', '--region', default="all", help='Default is all, or provide as argument')
-argparser.add_argument('-e', '--allocationid', default="null", help='ID of Aws Elastic IP')
-argparser.add_argument('-i', '--instanceid', default="null", help='ID of Aws EC2 Instance')
-argparser.add_argument('-a', '--associationid', default="null", help='ID of Aws Elastic IP Association')
-argparser.add_argument('-t', '--tags', help='Tags to add to a new Aws Elastic IP. Ej:\'[{"Key":"string","Value":"string"}]\'')
-
-
-try:
-    args = argparser.parse_args()
+def buildParser(prog=None):
+    argparser = argparse.ArgumentParser(prog=prog, description='Perform common instance tasks')
+    argparser.add_argument('action', help='Instance action to be performed list/add/associate/disassociate/release/orphans/batch/sync')
+    argparser.add_argument('-p', '--profile', default="default", help='If no profile provided, assumes default')
+    argparser.add_argument('-r', '--region', default="all", help='Default is all, or provide as argument, list/sync accept a comma separated list')
+    argparser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help='Number of regions queried in parallel when region is all')
+    argparser.add_argument('--region-ttl', type=int, default=DEFAULT_REGION_TTL, help='Seconds the cached list of regions is valid, a newly opted-in region is not used before it expires, default is %d' %(DEFAULT_REGION_TTL))
+    argparser.add_argument('--refresh-regions', action='store_true', help='Ignore the cached list of regions and query it again')
+    argparser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help='Number of records requested per API call')
+    argparser.add_argument('--max-pool-connections', type=int, default=DEFAULT_MAX_POOL_CONNECTIONS, help='Size of the HTTP connection pool of each Aws client')
+    argparser.add_argument('--retry-mode', choices=RETRY_MODES, default=DEFAULT_RETRY_MODE, help='Botocore retry mode, adaptive rate limits the calls when Aws throttles them')
+    argparser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='Maximum attempts of each Aws call, including retries')
+    argparser.add_argument('--metrics', nargs='?', const='-', help='Report latency, retries and throttling of Aws calls at exit, as a table on stderr or to a .json/.prom file')
+    argparser.add_argument('--profiles', help='Comma separated profiles, runs list/orphans once per profile in parallel processes')
+    argparser.add_argument('--accounts', help='Comma separated account IDs, runs list/orphans once per account assuming --role-name from --profile')
+    argparser.add_argument('--role-name', default=DEFAULT_ROLE_NAME, help='Role assumed in every account of --accounts, default is %s' %(DEFAULT_ROLE_NAME))
+    argparser.add_argument('--account-workers', type=int, default=DEFAULT_ACCOUNT_WORKERS, help='Number of profiles or accounts queried in parallel')
+    argparser.add_argument('--since', help='Snapshot file, print only the records added, modified or removed since it and update it')
+    argparser.add_argument('-F', '--filter', action='append', help='Filter applied by Aws on list as NAME=VALUE[,VALUE], ej: association=unassociated, instance=i-1, tag:env=prod')
+    argparser.add_argument('--tag', action='append', help='Select the Elastic IPs having tag KEY=VALUE, KEY=* or KEY for list/orphans, VALUE may use * and ?, can be repeated')
+    argparser.add_argument('--fields', help='Comma separated columns printed by list/orphans/batch, default is all')
+    argparser.add_argument('-o', '--output', choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT, help='Output format of list/orphans/batch, default is tsv')
+    argparser.add_argument('--from-cache', action='store_true', help='Answer from the local inventory instead of calling Aws')
+    argparser.add_argument('--max-age', type=int, default=DEFAULT_MAX_AGE, help='Seconds after which sync refreshes a region of the local inventory')
+    argparser.add_argument('--inventory', help='Path of the local inventory database, default is one per profile in the cache directory')
+    argparser.add_argument('-e', '--allocationid', default="null", help='ID of Aws Elastic IP')
+    argparser.add_argument('-i', '--instanceid', default="null", help='ID of Aws EC2 Instance')
+    argparser.add_argument('-a', '--associationid', default="null", help='ID of Aws Elastic IP Association')
+    argparser.add_argument('-t', '--tags', help='Tags to add to a new Aws Elastic IP. Ej:\'[{"Key":"string","Value":"string"}]\'')
+    argparser.add_argument('-m', '--manifest', help='csv or jsonl file of operations for batch, with columns action,region,allocationid,associationid,instanceid,tags')
+    return argparser
+
+
+## parse the command line, sys.argv when no argv is given
+def parseArguments(argv=None, prog=None):
+    try:
+        args = buildParser(prog).parse_args(argv)
+    except SystemExit as e:
+        ## -h exits with 0 once the help is printed
+        if not e.code:
+            raise
+        logging.error("Please run -h for help, Action and Region are mandatory arguments except for list.")
+        sys.exit(1)
     logging.info("Performing action:        %s" %(args.action))
     logging.info("Profile:                  %s" %(args.profile))
     logging.info("Region:                   %s" %(args.region))
     logging.info("Elastic IP Allocation ID: %s\n" %(args.allocationid))
-except:
-    logging.error("Please run -h for help, Action and Region are mandatory arguments except for list.")
-    sys.exit(1)
+    return args
+
+
+## set by main, the functions below read the command line from it
+args = None
 
 
 ## set ec2 client
 def setEc2client(regionName):
     try:
         global ec2client
-        ec2client = boto3.client('ec2', region_name=regionName)
+        ec2client = getClient('ec2', regionName)
         
     except:
         logging.error("Failed to set ec2client, please ensure arguments are passed.")
@@ -53,7 +103,7 @@ def setEc2client(regionName):
 def setEc2Emptyclient():
     try:
         global ec2client
-        ec2client = boto3.client('ec2')
+        ec2client = getClient('ec2')
         
     except:
         logging.error("Failed to set ec2client, please ensure arguments are passed.")
@@ -67,85 +117,343 @@ def checkEipId(eipid):
 
 
 def checkRegion(region):
-    if region == "all":
+    if region == "all" or "," in region:
         logging.error("Region must be provided as argument.")
         sys.exit(1) 
 
 
-## Get info of all security groups in selected region
+## columns printed by describeElasticIPs
+COLUMNS = ("Region", "Name", "Allocation ID", "Public IP", "Domain", "Association ID", "Instance ID", "Iface ID", "Private IP")
+## columns identifying a row across runs of --since
+KEY_COLUMNS = ("Allocation ID",)
+
+
+## Get info of all elastic ips in selected region, eips is a stream of awsctl.records.ElasticIP
 def describeElasticIPs(region, eips):
-    for eip in eips['Addresses']:
-        eipallocationid     = eip.get("AllocationId")
-        eippublicip = eip.get("PublicIp")
-        eipdomain = eip.get("Domain")
-        eipassociationid     = eip.get("AssociationId")
-        eipinstanceid = eip.get("InstanceId")
-        eipifaceid = eip.get("NetworkInterfaceId")
-        eipprivateip = eip.get("PrivateIpAddress")
-        
-        try:
-            for tags in eip['Tags']:
-                if tags['Key'] == 'Name':
-                    eipName = tags.get('Value')
-        except:
-            eipName = "Undefined"
-        
+    for eip in eips:
+        writer.write(eip.row())
+
+
+## Names of the regions to work with, all enabled regions when region is all
+def selectRegions(region):
+    if region != "all":
+        return [reg.strip() for reg in region.split(",") if reg.strip()]
+
+    setEc2Emptyclient()
+    try:
+        return getRegions(ec2client, profile, args.region_ttl, args.refresh_regions)
+    except ClientError as e:
+        logging.error(e)
+        sys.exit(1)
+
+
+## Regions to read from the local inventory, None reads all of them
+def cachedRegions(region):
+    if region == "all":
+        return None
+    return [reg.strip() for reg in region.split(",") if reg.strip()]
+
+
+def openInventory():
+    return Inventory(args.inventory or inventoryPath(profile))
+
+
+## Get Elastic IPs of a region with its own ec2 client, safe to run in a worker thread
+def listRegionElasticIPs(region):
+    client = getClient('ec2', region)
+    elasticIPs = paginate(client, 'describe_addresses', 'Addresses[]', args.page_size, Filters=filters)
+    if recordFilter is not None:
+        return (eip for eip in elasticIPs if recordFilter(eip))
+    return elasticIPs
+
+
+## Elastic IP records of a region, built in the worker thread as the pages arrive
+def regionElasticIPRecords(region):
+    return fromResponses(ElasticIP, region, listRegionElasticIPs(region))
+
+
+## Get the Elastic IPs of a region that cost money without being used: not
+## associated at all, or associated with a stopped instance. Stopped instances
+## are loaded in a set and joined in memory with the addresses.
+## Yields awsctl.records.ElasticIP records.
+def orphanRegionElasticIPs(region):
+    client = getClient('ec2', region)
+    stopped = set(paginate(client, 'describe_instances', 'Reservations[].Instances[].InstanceId', args.page_size,
+                           Filters=[{'Name': 'instance-state-name', 'Values': ['stopped', 'stopping']}]))
+
+    for eip in listRegionElasticIPs(region):
+        if not eip.get("AssociationId") and not eip.get("InstanceId"):
+            yield ElasticIP.fromResponse(region, eip)
+        elif eip.get("InstanceId") in stopped:
+            yield ElasticIP.fromResponse(region, eip)
+
+
+## columns of the batch report
+BATCH_COLUMNS = ("Row", "Region", "Action", "Allocation ID", "Association ID", "Instance ID", "Result", "Message")
+
+
+## Elastic IPs of a region indexed by allocation and association id, used by
+## batch to skip operations that are already done
+def loadRegionAddresses(region):
+    addresses = {'allocations': {}, 'associations': {}}
+    for eip in paginate(getClient('ec2', region), 'describe_addresses', 'Addresses[]', args.page_size):
+        addresses['allocations'][eip.get("AllocationId")] = eip
+        if eip.get("AssociationId"):
+            addresses['associations'][eip["AssociationId"]] = eip
+    return [addresses]
+
+
+## True when the Elastic IP has every tag of the list
+def hasTags(eip, tags):
+    current = dict((tag['Key'], tag.get('Value')) for tag in eip.get('Tags', []))
+    return all(current.get(tag['Key']) == tag.get('Value') for tag in tags)
+
+
+## manifest columns needed by each batch action, a tuple of columns means any of them
+REQUIRED_COLUMNS = {
+    'add':          (),
+    'associate':    ('allocationid', 'instanceid'),
+    'disassociate': (('allocationid', 'associationid'),),
+    'release':      ('allocationid',),
+}
+
+
+## Why a manifest row can not run, None when it has the columns of its action
+def checkEipOperation(row):
+    action = row.get('action')
+    if action not in REQUIRED_COLUMNS:
+        return "unknown action %s" %(action)
+    for columns in REQUIRED_COLUMNS[action]:
+        if isinstance(columns, str):
+            columns = (columns,)
+        if not any(row.get(column) for column in columns):
+            return "missing %s" %(" or ".join(columns))
+    if action == "add":
         try:
-            print("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s" %(region, eipName, eipallocationid, eippublicip, eipdomain, eipassociationid, eipinstanceid, eipifaceid, eipprivateip))
-        except:
-            logging.error("Failed to get security groups information.")
+            parseTags(row.get('tags'))
+        except ValueError as e:
+            return "invalid tags: %s" %(e)
+    return None
+
+
+## Run one manifest row against the addresses of its region, returns
+## (result, message, allocation id, association id) with result done/skipped/failed
+def runEipOperation(row, addresses):
+    client = getClient('ec2', row['region'])
+    action = row.get('action')
+    allocationId = row.get('allocationid') or None
+    associationId = row.get('associationid') or None
+    instanceId = row.get('instanceid') or None
+
+    try:
+        if action == "add":
+            tags = parseTags(row.get('tags'))
+            for eip in list(addresses['allocations'].values()):
+                if tags and hasTags(eip, tags):
+                    return "skipped", "already allocated", eip.get("AllocationId"), eip.get("AssociationId")
+
+            request = {'Domain': 'vpc'}
+            if tags:
+                request['TagSpecifications'] = [{'ResourceType': 'elastic-ip', 'Tags': tags}]
+            eip = client.allocate_address(**request)
+            eip['Tags'] = tags
+            addresses['allocations'][eip["AllocationId"]] = eip
+            return "done", eip.get("PublicIp"), eip["AllocationId"], None
+
+        elif action == "associate":
+            eip = addresses['allocations'].get(allocationId)
+            if eip is None:
+                return "failed", "allocation id not found", allocationId, None
+            if instanceId and eip.get("InstanceId") == instanceId:
+                return "skipped", "already associated", allocationId, eip.get("AssociationId")
+
+            ## re-point the address even if it is associated, as failover drills do
+            response = client.associate_address(AllocationId=allocationId, InstanceId=instanceId, AllowReassociation=True)
+            addresses['associations'].pop(eip.get("AssociationId"), None)
+            eip.update(AssociationId=response["AssociationId"], InstanceId=instanceId)
+            addresses['associations'][response["AssociationId"]] = eip
+            return "done", "", allocationId, response["AssociationId"]
+
+        elif action == "disassociate":
+            eip = addresses['associations'].get(associationId) if associationId else addresses['allocations'].get(allocationId)
+            if eip is None or not eip.get("AssociationId"):
+                return "skipped", "not associated", allocationId, associationId
+
+            client.disassociate_address(AssociationId=eip["AssociationId"])
+            addresses['associations'].pop(eip["AssociationId"], None)
+            associationId = eip.pop("AssociationId")
+            eip.pop("InstanceId", None)
+            return "done", "", eip.get("AllocationId"), associationId
+
+        elif action == "release":
+            if allocationId not in addresses['allocations']:
+                return "skipped", "already released", allocationId, None
+
+            client.release_address(AllocationId=allocationId)
+            addresses['allocations'].pop(allocationId, None)
+            return "done", "", allocationId, None
+
+        return "failed", "unknown action %s" %(action), allocationId, associationId
+    except (ClientError, BotoCoreError, ValueError) as e:
+        return "failed", str(e), allocationId, associationId
+
+
+## Allocation id of the Elastic IP of an association id, the association id
+## itself when the index of the region does not know it
+def associationAllocation(addresses, associationId):
+    if not associationId:
+        return None
+    eip = addresses['associations'].get(associationId)
+    return (eip and eip.get("AllocationId")) or associationId
+
+
+## Run the rows touching the same Elastic IP one after the other, in manifest order
+def runEipOperations(rows, addresses):
+    return [(number, row) + runEipOperation(row, addresses[row['region']]) for number, row in rows]
+
+
+## Run every row of the manifest and report them in manifest order. Addresses
+## of all regions are loaded concurrently first, then rows run in a pool of
+## args.workers threads, one task per Elastic IP. Returns False if a row failed.
+def runBatch(rows):
+    for row in rows:
+        if not row.get('region'):
+            row['region'] = region
+    if any(row['region'] == "all" or "," in row['region'] for row in rows):
+        logging.error("Region must be provided as argument or in every manifest row.")
+        sys.exit(1)
 
+    regions = sorted(set(row['region'] for row in rows))
+    addresses = dict(runRegions(regions, loadRegionAddresses, args.workers))
 
-def main():
+    results = []
+    tasks = OrderedDict()
+    for number, row in enumerate(rows, 1):
+        ## rows missing columns are reported on their own and never sent to Aws
+        problem = checkEipOperation(row)
+        if problem:
+            results.append((number, row, "failed", problem, row.get('allocationid'), row.get('associationid')))
+            continue
+        if row['region'] not in addresses:
+            results.append((number, row, "failed", "region not available", row.get('allocationid'), row.get('associationid')))
+            continue
+        ## rows of the same address, or adds with the same tags, must not run concurrently;
+        ## rows giving only the association id are keyed by the allocation it belongs to
+        key = (row['region'], row.get('allocationid') or associationAllocation(addresses[row['region']], row.get('associationid'))
+               or str(row.get('tags') or number))
+        tasks.setdefault(key, []).append((number, row))
+
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        for taskResults in executor.map(lambda task: runEipOperations(task, addresses), tasks.values()):
+            results.extend(taskResults)
+
+    for number, row, result, message, allocationId, associationId in sorted(results, key=itemgetter(0)):
+        writer.write((number, row['region'], row.get('action'), allocationId, associationId, row.get('instanceid'), result, message))
+    return all(result[2] != "failed" for result in results)
+
+
+## actions printing records, they can run across --profiles/--accounts and be diffed with --since
+LIST_ACTIONS = ('list', 'orphans')
+
+
+def main(argv=None, prog=None):
 	## setting some global variables so that it can be reused
     global ec2client
+    global args
     global profile
     global region
+    global filters
+    global recordFilter
+    global writer
 
+    logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+    args = parseArguments(argv, prog)
     profile = args.profile
     region = args.region
 
     ## First set aws profile
-    boto3.setup_default_session(profile_name=profile)
+    if args.metrics:
+        enableMetrics(args.metrics)
+    configureClients(profile, args.max_pool_connections, retryMode=args.retry_mode, maxAttempts=args.max_attempts)
+
+    ## server side filters and output of list
+    try:
+        filters, recordFilter = buildFilters('elastic_ips', args.filter)
+        filters.extend(tagFilters(args.tag))
+        columns = BATCH_COLUMNS if args.action == "batch" else COLUMNS
+        writer = RecordWriter(columns, projectFields(columns, args.fields), args.output)
+        if args.since:
+            if args.action not in LIST_ACTIONS or args.profiles or args.accounts:
+                raise ValueError("--since can only be used by %s on a single profile" %("/".join(LIST_ACTIONS)))
+            writer = DiffWriter(writer, KEY_COLUMNS, args.since)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    ## run the action once per profile or account in worker processes
+    if args.profiles or args.accounts:
+        sys.exit(fanOut(("ec2", "elastic-ips"), sys.argv[1:] if argv is None else argv, args, writer, LIST_ACTIONS))
+
+    ## answer from the local inventory without calling Aws
+    if args.from_cache:
+        try:
+            query = inventoryQuery(filters, recordFilter)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(1)
 
-    setEc2client(region)
+        if args.action != "list":
+            logging.error("Action %s can not be answered from the local inventory." %(args.action))
+            sys.exit(1)
 
-    if args.action != "list" or region != "all":
+        inventory = openInventory()
+        writer.header()
+        for region, records in groupby(inventory.records('elastic_ips', cachedRegions(region), **query), key=itemgetter(0)):
+            describeElasticIPs(region, fromResponses(ElasticIP, region, (record for _, record in records)))
+
+        writer.close()
+        inventory.close()
+        sys.exit(0)
+
+    if args.action not in ("list", "orphans", "batch", "sync"):
         checkRegion(region)
         setEc2client(region)
 
     if args.action == "list":
         logging.info("Listing Elastic IPs...")
-        print("Region\t\tName\tAllocation ID\tPublic IP\tDomain\tAssociation ID\tInstance ID\tIface ID\tPrivate IP")
-
-        if region == "all":
-            setEc2Emptyclient()
-            try:
-                regions = ec2client.describe_regions()['Regions']
-            except ClientError as e:
-                logging.error(e)
-            
-            for reg in regions:
-                region = reg['RegionName']
-                setEc2client(region)
-                elasticIPs = ec2client.describe_addresses()
-                describeElasticIPs(region, elasticIPs)
-        else:
-            elasticIPs = ec2client.describe_addresses()
-            describeElasticIPs(region, elasticIPs)
+        writer.header()
 
-        sys.exit(0)
+        failed = []
+        results = runRegions(selectRegions(region), regionElasticIPRecords, args.workers, onError=invalidateOnOptOut(profile), failed=failed)
+        for region, records in groupby(results, key=itemgetter(0)):
+            describeElasticIPs(region, (record for _, record in records))
+
+        ## the Elastic IPs of failed regions are not removed from a --since snapshot
+        writer.keep("Region", failed)
+        writer.close()
+        sys.exit(1 if failed else 0)
+
+    elif args.action == "orphans":
+        logging.info("Looking for orphaned Elastic IPs...")
+        writer.header()
+
+        failed = []
+        results = runRegions(selectRegions(region), orphanRegionElasticIPs, args.workers, onError=invalidateOnOptOut(profile), failed=failed)
+        for region, records in groupby(results, key=itemgetter(0)):
+            describeElasticIPs(region, (record for _, record in records))
+
+        writer.keep("Region", failed)
+        writer.close()
+        sys.exit(1 if failed else 0)
 
     elif args.action == "add":
         logging.info("Allocating new Elastic IP... ")
-        tags = json.loads(args.tags)
+        request = {'Domain': 'vpc'}
+        if args.tags:
+            request['TagSpecifications'] = [{'ResourceType': 'elastic-ip', 'Tags': json.loads(args.tags)}]
 
         try:
-            eip = ec2client.allocate_address(Domain='vpc')
-            ec2client.create_tags(
-                Resources=[eip["AllocationId"]],
-                Tags=tags
-            )
+            eip = ec2client.allocate_address(**request)
             logging.info("Allocating Elastic IP succesfully requested")
             logging.info("Region:        %s" %(region))
             logging.info("Allocation ID: %s" %(eip["AllocationId"]))
@@ -185,6 +493,39 @@ def main():
 
         sys.exit(0)
 
+    elif args.action == "batch":
+        if not args.manifest:
+            logging.error("Manifest must be provided as argument.")
+            sys.exit(1)
+
+        try:
+            rows = readManifest(args.manifest)
+        except (OSError, ValueError) as e:
+            logging.error("Failed to read manifest: %s" %(e))
+            sys.exit(1)
+
+        logging.info("Running %d Elastic IP operations... " %(len(rows)))
+        writer.header()
+        succeeded = runBatch(rows)
+        writer.close()
+        sys.exit(0 if succeeded else 1)
+
+    elif args.action == "sync":
+        logging.info("Synchronizing local inventory of Elastic IPs...")
+        if filters or recordFilter:
+            logging.error("Filters can not be used with sync, the local inventory keeps every resource.")
+            sys.exit(1)
+
+        inventory = openInventory()
+        synced = syncRegions(inventory, 'elastic_ips', selectRegions(region), listRegionElasticIPs, args.max_age, args.workers, invalidateOnOptOut(profile))
+        logging.info("Refreshed %d regions: %s" %(len(synced), " ".join(synced)))
+        inventory.close()
+        sys.exit(0)
+
 
 if __name__ == "__main__":
+    ## answered by the awsctl daemon when one is running
+    code = forward("ec2", "elastic-ips", sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
     main()
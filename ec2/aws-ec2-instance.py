@@ -7,32 +7,91 @@
 #
 
 
-import boto3
 from botocore.exceptions import ClientError
 import sys
 import argparse
 import logging
-
-## add default logger config
-logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+import os
+import re
+from collections import OrderedDict
+
+## make the shared awsctl helpers importable when running the script directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from awsctl.clients import configureClients, getClient, DEFAULT_MAX_POOL_CONNECTIONS, RETRY_MODES, DEFAULT_RETRY_MODE, DEFAULT_MAX_ATTEMPTS
+from awsctl.metrics import enableMetrics
+from awsctl.daemon import forward
+from awsctl.fanout import fanOut, DEFAULT_ACCOUNT_WORKERS
+from awsctl.snapshot import DiffWriter
+from awsctl.records import Instance, fromResponses, tagValue
+from awsctl.credentials import DEFAULT_ROLE_NAME
+from awsctl.regions import runRegions, getRegions, invalidateOnOptOut, DEFAULT_WORKERS, DEFAULT_REGION_TTL
+from awsctl.pagination import paginate, DEFAULT_PAGE_SIZE
+from awsctl.output import RecordWriter, OUTPUT_FORMATS, DEFAULT_OUTPUT
+from awsctl.filters import buildFilters, projectFields, tagFilters, inventoryQuery
+from awsctl.inventory import Inventory, inventoryPath, syncRegions, DEFAULT_MAX_AGE
+from awsctl.waiters import waitInstances, systemStatusOk, instanceStopped, chunks, MAX_ACTION_IDS, MAX_STATUS_IDS, DEFAULT_POLL_INTERVAL, DEFAULT_TIMEOUT
+from awsctl.watch import watchInstances, DEFAULT_MIN_INTERVAL, DEFAULT_MAX_INTERVAL
+from awsctl.locator import InstanceLocator, isInstanceID, findRegionInstances
+import time
+from itertools import groupby
+from operator import itemgetter
 
 ## First create arguments to work with them
-argparser = argparse.ArgumentParser(description='Perform common instance tasks')
-argparser.add_argument('action', help='Instance action to be performed list/start/stop/status')
-argparser.add_argument('-p', '--profile', default="default", help='If no profile provided, assumes default')
-argparser.add_argument('-r', '--region', default="all", help='Default is all, or provide as argument')
-argparser.add_argument('-i', '--instance', default="null", help='ID of Aws instance')
-
-
-try:
-    args = argparser.parse_args()
+def buildParser(prog=None):
+    argparser = argparse.ArgumentParser(prog=prog, description='Perform common instance tasks')
+    argparser.add_argument('action', help='Instance action to be performed list/start/stop/status/watch/sync')
+    argparser.add_argument('-p', '--profile', default="default", help='If no profile provided, assumes default')
+    argparser.add_argument('-r', '--region', default="all", help='Default is all, or provide as argument, list/sync/watch accept a comma separated list, start/stop/status find the region of the instances when it is not a single region')
+    argparser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help='Number of regions queried in parallel when region is all')
+    argparser.add_argument('--region-ttl', type=int, default=DEFAULT_REGION_TTL, help='Seconds the cached list of regions is valid, a newly opted-in region is not used before it expires, default is %d' %(DEFAULT_REGION_TTL))
+    argparser.add_argument('--refresh-regions', action='store_true', help='Ignore the cached list of regions and query it again')
+    argparser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help='Number of records requested per API call')
+    argparser.add_argument('--max-pool-connections', type=int, default=DEFAULT_MAX_POOL_CONNECTIONS, help='Size of the HTTP connection pool of each Aws client')
+    argparser.add_argument('--retry-mode', choices=RETRY_MODES, default=DEFAULT_RETRY_MODE, help='Botocore retry mode, adaptive rate limits the calls when Aws throttles them')
+    argparser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='Maximum attempts of each Aws call, including retries')
+    argparser.add_argument('--metrics', nargs='?', const='-', help='Report latency, retries and throttling of Aws calls at exit, as a table on stderr or to a .json/.prom file')
+    argparser.add_argument('--profiles', help='Comma separated profiles, runs list once per profile in parallel processes')
+    argparser.add_argument('--accounts', help='Comma separated account IDs, runs list once per account assuming --role-name from --profile')
+    argparser.add_argument('--role-name', default=DEFAULT_ROLE_NAME, help='Role assumed in every account of --accounts, default is %s' %(DEFAULT_ROLE_NAME))
+    argparser.add_argument('--account-workers', type=int, default=DEFAULT_ACCOUNT_WORKERS, help='Number of profiles or accounts queried in parallel')
+    argparser.add_argument('--since', help='Snapshot file, print only the records added, modified or removed since it and update it')
+    argparser.add_argument('-F', '--filter', action='append', help='Filter applied by Aws on list as NAME=VALUE[,VALUE], ej: state=running, vpc=vpc-1, type=t3.micro, tag:env=prod')
+    argparser.add_argument('--fields', help='Comma separated columns printed by list, default is all')
+    argparser.add_argument('-o', '--output', choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT, help='Output format of list/watch, default is tsv')
+    argparser.add_argument('--from-cache', action='store_true', help='Answer from the local inventory instead of calling Aws')
+    argparser.add_argument('--max-age', type=int, default=DEFAULT_MAX_AGE, help='Seconds after which sync refreshes a region of the local inventory')
+    argparser.add_argument('--inventory', help='Path of the local inventory database, default is one per profile in the cache directory')
+    argparser.add_argument('-i', '--instance', default="null", help='ID or Name tag of Aws instance, start/stop/status/watch accept a comma separated list')
+    argparser.add_argument('--refresh-locations', action='store_true', help='Ignore the remembered regions of the instances and search every region')
+    argparser.add_argument('-f', '--instances-file', help='File with one instance ID or Name tag per line to start/stop/status/watch')
+    argparser.add_argument('-t', '--tag', action='append', help='Select the instances having tag KEY=VALUE, KEY=* or KEY for list/start/stop/status/watch, VALUE may use * and ?, can be repeated')
+    argparser.add_argument('--poll-interval', type=int, default=DEFAULT_POLL_INTERVAL, help='Seconds between status checks while waiting for instances')
+    argparser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT, help='Seconds to wait for instances to reach their state, 0 watches forever')
+    argparser.add_argument('--until', help='Stop watching when all instances reach this state, ej: running')
+    argparser.add_argument('--min-interval', type=int, default=DEFAULT_MIN_INTERVAL, help='Minimum seconds between two status checks of a region while watching, at least 1')
+    argparser.add_argument('--max-interval', type=int, default=DEFAULT_MAX_INTERVAL, help='Maximum seconds between two status checks of a region while watching')
+    return argparser
+
+
+## parse the command line, sys.argv when no argv is given
+def parseArguments(argv=None, prog=None):
+    try:
+        args = buildParser(prog).parse_args(argv)
+    except SystemExit as e:
+        ## -h exits with 0 once the help is printed
+        if not e.code:
+            raise
+        logging.error("Please run -h for help, Action and Region are mandatory arguments except for list.")
+        sys.exit(1)
     logging.info("Performing action: %s" %(args.action))
     logging.info("Profile:           %s" %(args.profile))
     logging.info("Region:            %s" %(args.region))
     logging.info("Instance ID:       %s\n" %(args.instance))
-except:
-    logging.error("Please run -h for help, Action and Region are mandatory arguments except for list.")
-    sys.exit(1)
+    return args
+
+
+## set by main, the functions below read the command line from it
+args = None
 
 
 
@@ -40,7 +99,7 @@ except:
 def setEc2client(regionName):
     try:
         global ec2client
-        ec2client = boto3.client('ec2', region_name=regionName)
+        ec2client = getClient('ec2', regionName)
         
     except:
         logging.error("Failed to set ec2client, please ensure arguments are passed.")
@@ -51,153 +110,493 @@ def setEc2client(regionName):
 def setEc2Emptyclient():
     try:
         global ec2client
-        ec2client = boto3.client('ec2')
+        ec2client = getClient('ec2')
         
     except:
         logging.error("Failed to set ec2client, please ensure arguments are passed.")
         sys.exit(1)
 
 
-def checkInstanceID(instance):
-    if instance == "null":
-        logging.error("Instance ID must be provided as argument.")
-        sys.exit(1)
-
-
 def checkRegion(region):
-    if region == "all":
+    if region == "all" or "," in region:
         logging.error("Region must be provided as argument.")
         sys.exit(1) 
 
 
-## Get info of all instances in selected region
+## columns printed by describeInstances
+COLUMNS = ("Region", "Name", "ID", "Type", "Status", "Private IP", "Public IP")
+## columns identifying a row across runs of --since
+KEY_COLUMNS = ("ID",)
+
+
+## Get info of all instances in selected region, instances is a stream of awsctl.records.Instance
 def describeInstances(region, instances):
-    for data in instances['Reservations']:
-        for instance in data['Instances']:
-            iid        = instance.get("InstanceId", "NULL")
-            itype      = instance.get("InstanceType", "NULL")
-            istatus    = instance.get('State').get('Name')
-            iprivateip = instance.get("PublicIpAddress", "NULL")
-            ipublicip  = instance.get("PrivateIpAddress", "NULL")
-            ## now get tag name of instance
-            for tags in instance['Tags']:
-                if tags['Key'] == 'Name':
-                    iName = tags.get('Value', "NULL")
-                try: iName
-                except: iName = "Undefined"
-
-            try:
-                print("%s\t%s\t%s\t%s\t%s\t%s\t%s" %(region, iName, iid, itype, istatus, iprivateip, ipublicip))
-            except:
-                logging.error("Failed to get instance information.")
-
-
-## Start instance
-def startInstance(instance):
+    for instance in instances:
+        writer.write(instance.row())
+
+
+## Get the instance IDs passed as argument or in the instances file
+def requestedInstanceIDs():
+    instances = []
+    if args.instance != "null":
+        instances.extend(iid.strip() for iid in args.instance.split(",") if iid.strip())
+
+    if args.instances_file:
+        try:
+            with open(args.instances_file) as idsfile:
+                for line in idsfile:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        instances.append(line)
+        except OSError as e:
+            logging.error("Failed to read instances file: %s" %(e))
+            sys.exit(1)
+
+    return instances
+
+
+## IDs and Name tags of the command line split in (ids, names)
+def splitTargets(targets):
+    ids = [target for target in targets if isInstanceID(target)]
+    return ids, [target for target in targets if target not in ids]
+
+
+## Instances to start/stop/status in the region of the command line, as {id: instance},
+## and the targets not found in it. IDs and Name tags are resolved with
+## describe_instances filters, tags add the instances having all of them.
+def selectRegionInstances():
+    targets = list(OrderedDict.fromkeys(requestedInstanceIDs()))
+    ids, names = splitTargets(targets)
+    instances = OrderedDict()
+    found = set()
     try:
-        ec2client.start_instances(InstanceIds=[instance])
-        logging.info("Starting instance %s..." %(instance))
-        logging.info("Please wait to be ready")
-        waiter = ec2client.get_waiter('system_status_ok')
-        waiter.wait(InstanceIds=[instance])
-        logging.info("Instance %s is ready" %(instance))
-    except:
-        logging.error("Failed to start instance %s" %(instance))
+        for instance in findRegionInstances(region, ids, names, args.page_size):
+            instances[instance.get("InstanceId")] = instance
+            found.add(instance.get("InstanceId"))
+            found.update(tag.get('Value') for tag in instance.get('Tags') or [] if tag.get('Key') == 'Name')
+        if args.tag:
+            for instance in regionTaggedInstances(region):
+                instances[instance.get("InstanceId")] = instance
+    except ClientError as e:
+        logging.error(e)
+        sys.exit(1)
 
+    missing = [target for target in targets if target not in found]
+    for target in missing:
+        logging.error("Instance %s was not found in %s." %(target, region))
+    if not instances:
+        logging.error("No instance found, instance ID, Name, instances file or tag must be provided as argument.")
+        sys.exit(1)
+
+    return instances, missing
+
+
+## error codes of the calls Aws rejects for some of their instances
+INSTANCE_ERRORS = ("InvalidInstanceID", "IncorrectInstanceState")
+
+
+## Send action (start_instances/stop_instances) in as few calls as possible,
+## returns the instances accepted by Aws and the rejected ones. Aws rejects a
+## whole call for one bad ID, so the IDs named in the error are dropped and the
+## rest of the chunk is sent again; when the error names none of them the chunk
+## is split in halves until the bad ID is alone.
+def requestInstances(client, action, instances):
+    requested = []
+    rejected = []
+    pending = [list(chunk) for chunk in chunks(instances, MAX_ACTION_IDS)]
+    while pending:
+        chunk = pending.pop(0)
+        try:
+            getattr(client, action)(InstanceIds=chunk)
+            requested.extend(chunk)
+            continue
+        except ClientError as e:
+            error = e
+
+        code = error.response.get('Error', {}).get('Code', "")
+        named = set(re.split(r"[\s'\",]+", str(error)))
+        bad = [iid for iid in chunk if iid in named]
+        if not code.startswith(INSTANCE_ERRORS) or len(chunk) == 1:
+            bad = chunk
+        elif not bad:
+            half = len(chunk) // 2
+            pending[:0] = [chunk[:half], chunk[half:]]
+            continue
+
+        logging.error("Failed to %s instances %s: %s" %(action.split("_")[0], " ".join(bad), error))
+        rejected.extend(bad)
+        rest = [iid for iid in chunk if iid not in bad]
+        if rest:
+            pending.insert(0, rest)
+    return requested, rejected
+
+
+## Send action to the instances of every region of regions (region -> IDs) first,
+## returns region -> instances accepted by Aws, the rejected ones are added to failed
+def requestRegions(action, regions, failed):
+    requested = OrderedDict()
+    for reg, instances in regions.items():
+        accepted, rejected = requestInstances(getClient('ec2', reg), action, instances)
+        failed.extend(rejected)
+        if accepted:
+            requested[reg] = accepted
+    return requested
+
+
+## Wait the instances of every region together, each region is polled by
+## waitInstances in its own worker thread, yields (region, (id, state, reached)),
+## the regions that could not be polled are added to failed
+def waitRegions(regions, target, failed):
+    def waitRegion(reg):
+        return waitInstances(getClient('ec2', reg), regions[reg], target, args.poll_interval, args.timeout)
+    return runRegions(list(regions), waitRegion, args.workers, failed=failed)
+
+
+## Start the instances of regions (region -> IDs) and wait all of them together,
+## returns False when an instance was rejected, failed or timed out
+def startInstances(regions):
+    failed = []
+    started = requestRegions('start_instances', regions, failed)
+    logging.info("Starting %d instances..." %(sum(len(instances) for instances in started.values())))
+    logging.info("Please wait to be ready")
+    for reg, (iid, state, ready) in waitRegions(started, systemStatusOk, failed):
+        if ready:
+            logging.info("Instance %s is ready" %(iid))
+        else:
+            logging.error("Failed to start instance %s, it is %s" %(iid, state))
+            failed.append(iid)
+    return not failed
+
+
+## Stop the instances of regions (region -> IDs) and wait all of them together,
+## returns False when an instance was rejected, failed or timed out
+def stopInstances(regions):
+    failed = []
+    stopped = requestRegions('stop_instances', regions, failed)
+    logging.info("Stopping %d instances..." %(sum(len(instances) for instances in stopped.values())))
+    logging.info("Please wait to be stopped")
+    for reg, (iid, state, ready) in waitRegions(stopped, instanceStopped, failed):
+        if ready:
+            logging.info("Instance %s stopped" %(iid))
+        else:
+            logging.error("Failed to stop instance %s, it is %s" %(iid, state))
+            failed.append(iid)
+    return not failed
+
+
+## Get instance status, instances is a stream of instance records
+def statusInstance(instances):
+    for instance in instances:
+        iid        = instance.get("InstanceId", "NULL")
+        istatus    = instance.get('State').get('Name')
+        ## now get tag name of instance
+        iName = "Undefined"
+        for tags in instance.get('Tags') or []:
+            if tags['Key'] == 'Name':
+                iName = tags.get('Value', "NULL")
 
-## Stop instance
-def stopInstance(instance):
+        try:
+            logging.info("Instance %s with ID %s is %s" %(iName, iid, istatus))
+        except:
+            logging.error("Failed to get instance status.")
+
+
+## Instances to start/stop/status grouped by region, as region -> {id: instance},
+## when no single region is given, and the targets found nowhere. IDs and Name
+## tags are found by the locator, tags are searched in every region.
+def locateInstances():
+    located = OrderedDict()
+    missing = []
+    targets = list(OrderedDict.fromkeys(requestedInstanceIDs()))
+    if targets:
+        locator = InstanceLocator(profile)
+        matches, missing = locator.locate(targets, lambda: selectRegions(region), args.workers, args.page_size,
+                                          invalidateOnOptOut(profile), args.refresh_locations)
+        for target in missing:
+            logging.error("Instance %s was not found in any region." %(target))
+        for reg, instance in matches:
+            located.setdefault(reg, OrderedDict())[instance.get("InstanceId")] = instance
+
+    if args.tag:
+        for reg, instance in runRegions(selectRegions(region), regionTaggedInstances, args.workers, onError=invalidateOnOptOut(profile)):
+            located.setdefault(reg, OrderedDict())[instance.get("InstanceId")] = instance
+
+    if not located:
+        logging.error("No instance found, instance ID, Name, instances file or tag must be provided as argument.")
+        sys.exit(1)
+
+    for reg, instances in located.items():
+        logging.info("Found %d instances in %s" %(len(instances), reg))
+    return located, missing
+
+
+## Instances having the tags of the command line in a region, safe to run in a worker thread
+def regionTaggedInstances(region):
+    client = getClient('ec2', region)
+    return paginate(client, 'describe_instances', 'Reservations[].Instances[]', args.page_size, Filters=tagFilters(args.tag))
+
+
+## Remember the region of the listed instances for the locator
+def rememberInstances(locator, instances):
+    for instance in instances:
+        locator.remember(instance.region, instance.id, tagValue(instance.tags, 'Name'))
+        yield instance
+
+
+## Status of the instance IDs and Name tags of the command line from the local
+## inventory, returns False when a target is not in it
+def statusCachedInstances(inventory):
+    targets = list(OrderedDict.fromkeys(requestedInstanceIDs()))
+    if not targets:
+        logging.error("Instance ID, Name or instances file must be provided as argument.")
+        return False
+
+    found = set()
+    instances = OrderedDict()
+    ids = [target for target in targets if isInstanceID(target)]
+    if ids:
+        for _, record in inventory.records('instances', cachedRegions(region), ids=ids):
+            instances[record.get("InstanceId")] = record
+            found.add(record.get("InstanceId"))
+    for name in targets:
+        if name in ids:
+            continue
+        for _, record in inventory.records('instances', cachedRegions(region), name=name):
+            instances[record.get("InstanceId")] = record
+            found.add(name)
+
+    statusInstance(instances.values())
+    missing = [target for target in targets if target not in found]
+    for target in missing:
+        logging.error("Instance %s is not in the local inventory." %(target))
+    return not missing
+
+
+## Names of the regions to work with, all enabled regions when region is all
+def selectRegions(region):
+    if region != "all":
+        return [reg.strip() for reg in region.split(",") if reg.strip()]
+
+    setEc2Emptyclient()
     try:
-        ec2client.stop_instances(InstanceIds=[instance])
-        logging.info("Stopping instance %s..." %(instance))
-        logging.info("Please wait to be stopped")
-        waiter = ec2client.get_waiter('instance_stopped')
-        waiter.wait(InstanceIds=[instance])
-        logging.info("Instance %s stopped" %(instance))
-    except:
-        logging.error("Failed to stop instance %s" %(instance))
+        return getRegions(ec2client, profile, args.region_ttl, args.refresh_regions)
+    except ClientError as e:
+        logging.error(e)
+        sys.exit(1)
+
+
+## Regions to read from the local inventory, None reads all of them
+def cachedRegions(region):
+    if region == "all":
+        return None
+    return [reg.strip() for reg in region.split(",") if reg.strip()]
+
 
+def openInventory():
+    return Inventory(args.inventory or inventoryPath(profile))
 
-## Get instance status
-def statusInstance(instance):
-    for data in instance['Reservations']:
-        for instance in data['Instances']:
-            iid        = instance.get("InstanceId", "NULL")
-            istatus    = instance.get('State').get('Name')
-            ## now get tag name of instance
-            for tags in instance['Tags']:
-                if tags['Key'] == 'Name':
-                    iName = tags.get('Value', "NULL")
-                try: iName
-                except: iName = "Undefined"
 
-            try:
-                logging.info("Instance %s with ID %s is %s" %(iName, iid, istatus))
-            except:
-                logging.error("Failed to get instance status.")
+## Get instances of a region with its own ec2 client, safe to run in a worker thread
+def listRegionInstances(region):
+    client = getClient('ec2', region)
+    return paginate(client, 'describe_instances', 'Reservations[].Instances[]', args.page_size, Filters=filters)
 
 
-def main():
+## Instance records of a region, built in the worker thread as the pages arrive
+def regionInstanceRecords(region):
+    return fromResponses(Instance, region, listRegionInstances(region))
+
+
+## Get the IDs of the instances to watch in a region, matching the requested
+## IDs, Name tags and tags with describe_instances filters
+def locateRegionInstances(region):
+    client = getClient('ec2', region)
+    filters = tagFilters(args.tag)
+    targets = requestedInstanceIDs()
+    if not targets:
+        return paginate(client, 'describe_instances', 'Reservations[].Instances[].InstanceId', args.page_size, Filters=filters)
+
+    ids, names = splitTargets(list(OrderedDict.fromkeys(targets)))
+    ## an instance can match both its ID and its Name tag
+    return list(OrderedDict.fromkeys(instance.get("InstanceId")
+                                     for instance in findRegionInstances(region, ids, names, args.page_size, filters)))
+
+
+## columns printed by watchRegions
+WATCH_COLUMNS = ("Time", "Region", "ID", "Status", "System Status", "Instance Status")
+
+
+## Watch instance state changes across regions, only changes are printed
+def watchRegions(regions):
+    targets = None
+    if args.instance != "null" or args.instances_file or args.tag:
+        targets = {}
+        for reg, iid in runRegions(regions, locateRegionInstances, args.workers):
+            targets.setdefault(reg, []).append(iid)
+        regions = [reg for reg in regions if reg in targets]
+        if not regions:
+            logging.error("None of the requested instances was found.")
+            sys.exit(1)
+
+    def pollRegion(reg):
+        client = getClient('ec2', reg)
+        if targets is None:
+            return paginate(client, 'describe_instance_status', 'InstanceStatuses[]', args.page_size, IncludeAllInstances=True)
+        return (status for chunk in chunks(targets[reg], MAX_STATUS_IDS)
+                for status in client.describe_instance_status(InstanceIds=chunk, IncludeAllInstances=True)['InstanceStatuses'])
+
+    watchWriter = RecordWriter(WATCH_COLUMNS, fmt=args.output)
+
+    def onChange(reg, iid, old, new):
+        watchWriter.write((time.strftime("%Y-%m-%dT%H:%M:%S"), reg, iid, new[0], new[1], new[2]))
+        watchWriter.flush()
+
+    watchWriter.header()
+    watchWriter.flush()
+    return watchInstances(regions, pollRegion, onChange, args.min_interval, args.max_interval,
+                          args.timeout, args.until, args.workers)
+
+
+## actions printing records, they can run across --profiles/--accounts and be diffed with --since
+LIST_ACTIONS = ('list',)
+
+
+def main(argv=None, prog=None):
     ## setting some global variables so that it can be reused
     global ec2client
+    global args
     global profile
     global region
+    global filters
+    global recordFilter
+    global writer
 
+    logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+    args = parseArguments(argv, prog)
     profile = args.profile
     region = args.region
 
     ## First set aws profile
-    boto3.setup_default_session(profile_name=profile)
-    
+    if args.metrics:
+        enableMetrics(args.metrics)
+    configureClients(profile, args.max_pool_connections, retryMode=args.retry_mode, maxAttempts=args.max_attempts)
+
+    ## server side filters and output of list
+    try:
+        filters, recordFilter = buildFilters('instances', args.filter)
+        filters.extend(tagFilters(args.tag))
+        writer = RecordWriter(COLUMNS, projectFields(COLUMNS, args.fields), args.output)
+        if args.since:
+            if args.action not in LIST_ACTIONS or args.profiles or args.accounts:
+                raise ValueError("--since can only be used by %s on a single profile" %("/".join(LIST_ACTIONS)))
+            writer = DiffWriter(writer, KEY_COLUMNS, args.since)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    ## run the action once per profile or account in worker processes
+    if args.profiles or args.accounts:
+        sys.exit(fanOut(("ec2", "instances"), sys.argv[1:] if argv is None else argv, args, writer, LIST_ACTIONS))
+
+    ## answer from the local inventory without calling Aws
+    if args.from_cache:
+        try:
+            query = inventoryQuery(filters, recordFilter)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(1)
+
+        inventory = openInventory()
+        if args.action == "list":
+            writer.header()
+            for region, records in groupby(inventory.records('instances', cachedRegions(region), **query), key=itemgetter(0)):
+                describeInstances(region, fromResponses(Instance, region, (record for _, record in records)))
+            writer.close()
+        elif args.action == "status":
+            if not statusCachedInstances(inventory):
+                inventory.close()
+                sys.exit(1)
+        else:
+            logging.error("Action %s can not be answered from the local inventory." %(args.action))
+            sys.exit(1)
+
+        inventory.close()
+        sys.exit(0)
+
+    ## start/stop/status locate the instances when no single region is given
+    if args.action in ("start", "stop", "status") and (region == "all" or "," in region):
+        located, missing = locateInstances()
+        done = True
+        if args.action == "status":
+            statusInstance(instance for instances in located.values() for instance in instances.values())
+        elif args.action == "start":
+            done = startInstances(OrderedDict((reg, list(instances)) for reg, instances in located.items()))
+        else:
+            done = stopInstances(OrderedDict((reg, list(instances)) for reg, instances in located.items()))
+        sys.exit(0 if done and not missing else 1)
+
     ## load region passed in arguments if action is not list
-    if args.action != "list" or region != "all":
+    if args.action not in ("list", "sync", "watch"):
         checkRegion(region)
         setEc2client(region)
 
     if args.action == "list":
         logging.info("Listing instances...")
-        print("Region\tName\tID\tType\tStatus\tPrivate IP\tPublic IP")
-
-        if region == "all":
-            setEc2Emptyclient()
-            try:
-                regions = ec2client.describe_regions()['Regions']
-            except ClientError as e:
-                logging.error(e)
-
-            for reg in regions:
-                region = reg['RegionName']
-                setEc2client(region)
-                instances = ec2client.describe_instances()
-                describeInstances(region, instances)
-        else:
-            instances = ec2client.describe_instances()
-            describeInstances(region, instances)
+        writer.header()
 
-        sys.exit(0)
+        locator = InstanceLocator(profile)
+        failed = []
+        results = runRegions(selectRegions(region), regionInstanceRecords, args.workers, onError=invalidateOnOptOut(profile), failed=failed)
+        for region, records in groupby(results, key=itemgetter(0)):
+            describeInstances(region, rememberInstances(locator, (record for _, record in records)))
+
+        ## the instances of failed regions are not removed from a --since snapshot
+        writer.keep("Region", failed)
+        writer.close()
+        locator.save()
+        sys.exit(1 if failed else 0)
 
     elif args.action == "start":
-        checkInstanceID(args.instance)
-        startInstance(args.instance)
-        sys.exit(0)
+        instances, missing = selectRegionInstances()
+        done = startInstances(OrderedDict([(region, list(instances))]))
+        sys.exit(0 if done and not missing else 1)
 
     elif args.action == "stop":
-        checkInstanceID(args.instance)
-        stopInstance(args.instance)
-        sys.exit(0)
+        instances, missing = selectRegionInstances()
+        done = stopInstances(OrderedDict([(region, list(instances))]))
+        sys.exit(0 if done and not missing else 1)
 
     elif args.action == "status":
-        checkInstanceID(args.instance)
-        logging.info("Checking status of instance %s... " %(args.instance))
-        
+        logging.info("Checking status of instances in %s... " %(region))
+        instances, missing = selectRegionInstances()
+        statusInstance(instances.values())
+        sys.exit(1 if missing else 0)
+
+    elif args.action == "watch":
+        logging.info("Watching instances...")
         try:
-            instance = ec2client.describe_instances(InstanceIds=[args.instance])
-        except ClientError as e:
-            logging.error(e)
-            
-        statusInstance(instance)
+            reached = watchRegions(selectRegions(region))
+        except KeyboardInterrupt:
+            sys.exit(0)
+
+        sys.exit(0 if reached or args.until is None else 1)
+
+    elif args.action == "sync":
+        logging.info("Synchronizing local inventory of instances...")
+        if filters or recordFilter:
+            logging.error("Filters can not be used with sync, the local inventory keeps every resource.")
+            sys.exit(1)
+
+        inventory = openInventory()
+        synced = syncRegions(inventory, 'instances', selectRegions(region), listRegionInstances, args.max_age, args.workers, invalidateOnOptOut(profile))
+        logging.info("Refreshed %d regions: %s" %(len(synced), " ".join(synced)))
+        inventory.close()
         sys.exit(0)
 
 
 if __name__ == "__main__":
+    ## answered by the awsctl daemon when one is running
+    code = forward("ec2", "instances", sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
     main()
@@ -6,38 +6,94 @@
 # Dependencies: python3, boto3, Aws cli
 #
 
-import boto3
 from botocore.exceptions import ClientError
 import sys
 import argparse
 import logging
-
-## add default logger config
-logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+import os
+import ipaddress
+
+## make the shared awsctl helpers importable when running the script directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from awsctl.clients import configureClients, getClient, DEFAULT_MAX_POOL_CONNECTIONS, RETRY_MODES, DEFAULT_RETRY_MODE, DEFAULT_MAX_ATTEMPTS
+from awsctl.metrics import enableMetrics
+from awsctl.daemon import forward
+from awsctl.fanout import fanOut, DEFAULT_ACCOUNT_WORKERS
+from awsctl.snapshot import DiffWriter
+from awsctl.records import SecurityGroup, fromResponses
+from awsctl.credentials import DEFAULT_ROLE_NAME
+from awsctl.regions import runRegions, getRegions, invalidateOnOptOut, DEFAULT_WORKERS, DEFAULT_REGION_TTL
+from awsctl.pagination import paginate, DEFAULT_PAGE_SIZE
+from awsctl.output import RecordWriter, OUTPUT_FORMATS, DEFAULT_OUTPUT
+from awsctl.filters import buildFilters, projectFields, tagFilters, inventoryQuery
+from awsctl.exposure import ExposureIndex
+from awsctl.sggraph import GroupGraph, parsePorts, GRAPH_FORMATS
+from awsctl.inventory import Inventory, inventoryPath, syncRegions, DEFAULT_MAX_AGE
+from itertools import groupby
+from operator import itemgetter
 
 ## First create arguments to work with them
-argparser = argparse.ArgumentParser(description='Perform common instance tasks')
-argparser.add_argument('action', help='Instance action to be performed list/rules')
-argparser.add_argument('-p', '--profile', default="default", help='If no profile provided, assumes default')
-argparser.add_argument('-r', '--region', default="all", help='Default is all, or provide as argument')
-argparser.add_argument('-i', '--secgroupid', default="null", help='ID of Aws security group')
-
-try:
-    args = argparser.parse_args()
+def buildParser(prog=None):
+    argparser = argparse.ArgumentParser(prog=prog, description='Perform common instance tasks')
+    argparser.add_argument('action', help='Instance action to be performed list/rules/exposure/graph/unused/sync')
+    argparser.add_argument('-p', '--profile', default="default", help='If no profile provided, assumes default')
+    argparser.add_argument('-r', '--region', default="all", help='Default is all, or provide as argument, list/sync accept a comma separated list')
+    argparser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help='Number of regions queried in parallel when region is all')
+    argparser.add_argument('--region-ttl', type=int, default=DEFAULT_REGION_TTL, help='Seconds the cached list of regions is valid, a newly opted-in region is not used before it expires, default is %d' %(DEFAULT_REGION_TTL))
+    argparser.add_argument('--refresh-regions', action='store_true', help='Ignore the cached list of regions and query it again')
+    argparser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help='Number of records requested per API call')
+    argparser.add_argument('--max-pool-connections', type=int, default=DEFAULT_MAX_POOL_CONNECTIONS, help='Size of the HTTP connection pool of each Aws client')
+    argparser.add_argument('--retry-mode', choices=RETRY_MODES, default=DEFAULT_RETRY_MODE, help='Botocore retry mode, adaptive rate limits the calls when Aws throttles them')
+    argparser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='Maximum attempts of each Aws call, including retries')
+    argparser.add_argument('--metrics', nargs='?', const='-', help='Report latency, retries and throttling of Aws calls at exit, as a table on stderr or to a .json/.prom file')
+    argparser.add_argument('--profiles', help='Comma separated profiles, runs list/rules/exposure/unused once per profile in parallel processes')
+    argparser.add_argument('--accounts', help='Comma separated account IDs, runs list/rules/exposure/unused once per account assuming --role-name from --profile')
+    argparser.add_argument('--role-name', default=DEFAULT_ROLE_NAME, help='Role assumed in every account of --accounts, default is %s' %(DEFAULT_ROLE_NAME))
+    argparser.add_argument('--account-workers', type=int, default=DEFAULT_ACCOUNT_WORKERS, help='Number of profiles or accounts queried in parallel')
+    argparser.add_argument('--since', help='Snapshot file, print only the records added, modified or removed since it and update it')
+    argparser.add_argument('--cidr', default="0.0.0.0/0", help='Address or network checked by exposure, default is 0.0.0.0/0')
+    argparser.add_argument('--port', type=int, help='Port checked by exposure, default is any port')
+    argparser.add_argument('--protocol', help='Protocol checked by exposure/graph (tcp/udp/icmp), default is any protocol')
+    argparser.add_argument('--direction', choices=('inbound', 'outbound'), default="inbound", help='Rules checked by exposure, default is inbound')
+    argparser.add_argument('--ports', help='Comma separated ports or ranges followed by graph, ej: 22,443,8000-8080, default is any port')
+    argparser.add_argument('--graph-format', choices=GRAPH_FORMATS, default="json", help='Output format of graph, default is json')
+    argparser.add_argument('-F', '--filter', action='append', help='Filter applied by Aws on list as NAME=VALUE[,VALUE], ej: vpc=vpc-1, name=default, tag:env=prod')
+    argparser.add_argument('--tag', action='append', help='Select the security groups having tag KEY=VALUE, KEY=* or KEY, VALUE may use * and ?, can be repeated')
+    argparser.add_argument('--fields', help='Comma separated columns printed by list/rules/exposure/unused, default is all')
+    argparser.add_argument('-o', '--output', choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT, help='Output format of list/rules/exposure/unused, default is tsv')
+    argparser.add_argument('--from-cache', action='store_true', help='Answer from the local inventory instead of calling Aws')
+    argparser.add_argument('--max-age', type=int, default=DEFAULT_MAX_AGE, help='Seconds after which sync refreshes a region of the local inventory')
+    argparser.add_argument('--inventory', help='Path of the local inventory database, default is one per profile in the cache directory')
+    argparser.add_argument('-i', '--secgroupid', default="null", help='ID of Aws security group')
+    return argparser
+
+
+## parse the command line, sys.argv when no argv is given
+def parseArguments(argv=None, prog=None):
+    try:
+        args = buildParser(prog).parse_args(argv)
+    except SystemExit as e:
+        ## -h exits with 0 once the help is printed
+        if not e.code:
+            raise
+        logging.error("Please run -h for help, Action and Region are mandatory arguments except for list.")
+        sys.exit(1)
     logging.info("Performing action: %s" %(args.action))
     logging.info("Profile:           %s" %(args.profile))
     logging.info("Region:            %s" %(args.region))
     logging.info("Security Group ID: %s\n" %(args.secgroupid))
-except:
-    logging.error("Please run -h for help, Action and Region are mandatory arguments except for list.")
-    sys.exit(1)
+    return args
+
+
+## set by main, the functions below read the command line from it
+args = None
 
 
 ## set ec2 client
 def setEc2client(regionName):
     try:
         global ec2client
-        ec2client = boto3.client('ec2', region_name=regionName)
+        ec2client = getClient('ec2', regionName)
         
     except:
         logging.error("Failed to set ec2client, please ensure arguments are passed.")
@@ -48,7 +104,7 @@ def setEc2client(regionName):
 def setEc2Emptyclient():
     try:
         global ec2client
-        ec2client = boto3.client('ec2')
+        ec2client = getClient('ec2')
         
     except:
         logging.error("Failed to set ec2client, please ensure arguments are passed.")
@@ -62,105 +118,216 @@ def checkSGID(secgroup):
 
 
 def checkRegion(region):
-    if region == "all":
+    if region == "all" or "," in region:
         logging.error("Region must be provided as argument.")
         sys.exit(1) 
 
 
-## Get info of all security groups in selected region
+## columns printed by describeSecurityGroups
+COLUMNS = ("Region", "Name", "ID", "VPC")
+## columns identifying a row across runs of --since
+KEY_COLUMNS = ("ID",)
+
+
+## Get info of all security groups in selected region, secgroups is a stream of awsctl.records.SecurityGroup
 def describeSecurityGroups(region, secgroups):
-    for secgroup in secgroups['SecurityGroups']:
-        sgid        = secgroup.get("GroupId", "NULL")
-        sgVPCid     = secgroup.get("VpcId", "NULL")
-        sgName      = secgroup.get('GroupName')
+    for secgroup in secgroups:
+        writer.write(secgroup.row())
 
-        try:
-            print("%s\t%s\t%s\t%s" %(region, sgName, sgid, sgVPCid))
-        except:
-            logging.error("Failed to get security groups information.")
+
+## columns printed by describeSecurityGroupRules
+RULE_COLUMNS = ("Region", "Group ID", "Group Name", "Direction", "Protocol", "From Port", "To Port", "Peer", "Description")
+RULE_KEY_COLUMNS = ("Group ID", "Direction", "Protocol", "From Port", "To Port", "Peer")
 
 
+## secgroups is a stream of awsctl.records.SecurityGroup
 def describeSecurityGroupRules(region, secgroups):
-	for secgroup in secgroups['SecurityGroups']:
-		sgName = secgroup.get('GroupName')
+	for secgroup in secgroups:
+		logging.info("Getting rules for Security Group %s" %(secgroup.name))
+
+		for rule in secgroup.rules:
+			writer.write(rule.row())
+
+
+## Print the rules of all security groups allowing args.cidr, loaded from Aws
+## or the local inventory into an ExposureIndex
+def describeExposure(groups):
+    index = ExposureIndex()
+    for reg, secgroup in groups:
+        index.addGroup(reg, secgroup)
+    logging.info("Indexed %d rules" %(index.size))
+
+    for rule in index.query(args.cidr, args.protocol, args.port, args.direction):
+        writer.write(rule.row())
+
+
+## Print the graph of security group references, or only the part reachable
+## from args.secgroupid on args.ports when a group is given
+def describeGraph(groups):
+    graph = GroupGraph()
+    for reg, secgroup in groups:
+        graph.addGroup(reg, secgroup)
+    logging.info("Loaded %d security groups and prefix lists" %(len(graph.nodes)))
+
+    nodeIds = None
+    hops = None
+    portRanges = None
+    protocol = None
+    if args.secgroupid != "null":
+        portRanges = parsePorts(args.ports)
+        protocol = args.protocol
+        hops = graph.reachable(args.secgroupid, portRanges, protocol)
+        nodeIds = hops.keys()
+
+    ## only the edges open on the ports are printed, like the ones followed by reachable
+    if args.graph_format == "dot":
+        print(graph.toDot(nodeIds, hops, portRanges, protocol))
+    else:
+        print(graph.toJson(nodeIds, hops, portRanges, protocol))
+
+
+## Names of the regions to work with, all enabled regions when region is all
+def selectRegions(region):
+    if region != "all":
+        return [reg.strip() for reg in region.split(",") if reg.strip()]
+
+    setEc2Emptyclient()
+    try:
+        return getRegions(ec2client, profile, args.region_ttl, args.refresh_regions)
+    except ClientError as e:
+        logging.error(e)
+        sys.exit(1)
+
+
+## Regions to read from the local inventory, None reads all of them
+def cachedRegions(region):
+    if region == "all":
+        return None
+    return [reg.strip() for reg in region.split(",") if reg.strip()]
+
 
-		logging.info("Getting inbound rules for Security Group %s" %(sgName))
-		print("Protocol\tFrom Port\tTo Port\tCidr\t\tDescription")
+def openInventory():
+    return Inventory(args.inventory or inventoryPath(profile))
 
-		for inbound in secgroup['IpPermissions']:
-			from_port = inbound.get("FromPort", "NULL")
-			protocol  = inbound.get("IpProtocol", "NULL")
-			to_port   = inbound.get("ToPort", "NULL")
-			
-			for ipr in inbound['IpRanges']:
-				cidr_ip = ipr.get("CidrIp")
-				desc    = ipr.get("Description")
-				print("%s\t\t%s\t\t%s\t%s\t%s" %(protocol, from_port, to_port, cidr_ip, desc))
 
-			for ip6r in inbound['Ipv6Ranges']:
-				cidr_ip = ipr.get("CidrIp")
-				desc    = ipr.get("Description")
-				print("%s\t%s\t%s\t%s\t%s" %(protocol, from_port, to_port, cidr_ip, desc))
+## Get security groups of a region with its own ec2 client, safe to run in a worker thread
+def listRegionSecurityGroups(region):
+    client = getClient('ec2', region)
+    return paginate(client, 'describe_security_groups', 'SecurityGroups[]', args.page_size, Filters=filters)
 
-		logging.info("Getting outboud rules for Security Group %s" %(sgName))
-		print("Protocol\tFrom Port\tTo Port\tCidr\t\tDescription")
 
-		for outbound in secgroup['IpPermissionsEgress']:
-			from_port = outbound.get("FromPort", "NULL")
-			protocol  = outbound.get("IpProtocol", "NULL")
-			to_port   = outbound.get("ToPort", "NULL")
+## Security group records of a region, built in the worker thread as the pages arrive
+def regionSecurityGroupRecords(region):
+    return fromResponses(SecurityGroup, region, listRegionSecurityGroups(region))
 
-			for ipr in outbound['IpRanges']:
-				cidr_ip = ipr.get("CidrIp")
-				desc    = ipr.get("Description")
-				print("%s\t\t%s\t\t%s\t%s\t%s" %(protocol, from_port, to_port, cidr_ip, desc))
 
-			for ip6r in outbound['Ipv6Ranges']:
-				cidr_ip = ipr.get("CidrIp")
-				desc    = ipr.get("Description")
-				print("%s\t%s\t%s\t%s\t%s" %(protocol, from_port, to_port, cidr_ip, desc))	
+## Get the security groups of a region not attached to any network interface,
+## joining them in memory with the set of groups used by the interfaces.
+## Default groups can not be deleted so they are never reported.
+## Yields awsctl.records.SecurityGroup records.
+def unusedRegionSecurityGroups(region):
+    client = getClient('ec2', region)
+    used = set(paginate(client, 'describe_network_interfaces', 'NetworkInterfaces[].Groups[].GroupId', args.page_size))
 
+    for secgroup in listRegionSecurityGroups(region):
+        if secgroup.get("GroupId") not in used and secgroup.get("GroupName") != "default":
+            yield SecurityGroup.fromResponse(region, secgroup)
 
 
-def main():
+## actions printing records, they can run across --profiles/--accounts and be diffed with --since
+LIST_ACTIONS = ('list', 'rules', 'exposure', 'unused')
+
+
+def main(argv=None, prog=None):
 	## setting some global variables so that it can be reused
     global ec2client
+    global args
     global profile
     global region
+    global filters
+    global recordFilter
+    global writer
 
+    logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+    args = parseArguments(argv, prog)
     profile = args.profile
     region = args.region
 
     ## First set aws profile
-    boto3.setup_default_session(profile_name=profile)
+    if args.metrics:
+        enableMetrics(args.metrics)
+    configureClients(profile, args.max_pool_connections, retryMode=args.retry_mode, maxAttempts=args.max_attempts)
+
+    ## server side filters and output of list
+    try:
+        filters, recordFilter = buildFilters('security_groups', args.filter)
+        filters.extend(tagFilters(args.tag))
+        columns = RULE_COLUMNS if args.action in ("rules", "exposure") else COLUMNS
+        writer = RecordWriter(columns, projectFields(columns, args.fields), args.output)
+        if args.since:
+            if args.action not in LIST_ACTIONS or args.profiles or args.accounts:
+                raise ValueError("--since can only be used by %s on a single profile" %("/".join(LIST_ACTIONS)))
+            writer = DiffWriter(writer, RULE_KEY_COLUMNS if columns is RULE_COLUMNS else KEY_COLUMNS, args.since)
+        ipaddress.ip_network(args.cidr, strict=False)
+        parsePorts(args.ports)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    ## run the action once per profile or account in worker processes
+    if args.profiles or args.accounts:
+        sys.exit(fanOut(("ec2", "security-groups"), sys.argv[1:] if argv is None else argv, args, writer, LIST_ACTIONS))
+
+    ## answer from the local inventory without calling Aws
+    if args.from_cache:
+        try:
+            query = inventoryQuery(filters, recordFilter)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(1)
+
+        inventory = openInventory()
+        if args.action == "list":
+            writer.header()
+            for region, records in groupby(inventory.records('security_groups', cachedRegions(region), **query), key=itemgetter(0)):
+                describeSecurityGroups(region, fromResponses(SecurityGroup, region, (record for _, record in records)))
+            writer.close()
+        elif args.action == "rules":
+            checkSGID(args.secgroupid)
+            writer.header()
+            for region, records in groupby(inventory.records('security_groups', ids=[args.secgroupid]), key=itemgetter(0)):
+                describeSecurityGroupRules(region, fromResponses(SecurityGroup, region, (record for _, record in records)))
+            writer.close()
+        elif args.action == "exposure":
+            writer.header()
+            describeExposure(inventory.records('security_groups', cachedRegions(region), **query))
+            writer.close()
+        elif args.action == "graph":
+            describeGraph(inventory.records('security_groups', cachedRegions(region), **query))
+        else:
+            logging.error("Action %s can not be answered from the local inventory." %(args.action))
+            sys.exit(1)
 
-    setEc2client(region)
+        inventory.close()
+        sys.exit(0)
 
-    if args.action != "list" or region != "all":
+    if args.action not in ("list", "exposure", "graph", "unused", "sync"):
         checkRegion(region)
         setEc2client(region)
 
     if args.action == "list":
         logging.info("Listing Security Groups...")
-        print("Region\t\tName\tID\tVPC")
-
-        if region == "all":
-            setEc2Emptyclient()
-            try:
-                regions = ec2client.describe_regions()['Regions']
-            except ClientError as e:
-                logging.error(e)
-                
-            for reg in regions:
-                region = reg['RegionName']
-                setEc2client(region)
-                securityGroups = ec2client.describe_security_groups()
-                describeSecurityGroups(region, securityGroups)
-        else:
-            securityGroups = ec2client.describe_security_groups()
-            describeSecurityGroups(region, securityGroups)
+        writer.header()
 
-        sys.exit(0)
+        failed = []
+        results = runRegions(selectRegions(region), regionSecurityGroupRecords, args.workers, onError=invalidateOnOptOut(profile), failed=failed)
+        for region, records in groupby(results, key=itemgetter(0)):
+            describeSecurityGroups(region, (record for _, record in records))
+
+        ## the groups of failed regions are not removed from a --since snapshot
+        writer.keep("Region", failed)
+        writer.close()
+        sys.exit(1 if failed else 0)
 
     elif args.action == "rules":
         checkSGID(args.secgroupid)
@@ -170,10 +337,57 @@ def main():
             securityGroups = ec2client.describe_security_groups(GroupIds=[args.secgroupid])
         except ClientError as e:
             logging.error(e)
+            sys.exit(1)
+
+        writer.header()
+        describeSecurityGroupRules(region, fromResponses(SecurityGroup, region, securityGroups['SecurityGroups']))
+        writer.close()
+        sys.exit(0)
 
-        describeSecurityGroupRules(region, securityGroups)
+    elif args.action == "exposure":
+        logging.info("Looking for rules allowing %s... " %(args.cidr))
+        writer.header()
+        failed = []
+        describeExposure(runRegions(selectRegions(region), listRegionSecurityGroups, args.workers, onError=invalidateOnOptOut(profile), failed=failed))
+        writer.keep("Region", failed)
+        writer.close()
+        sys.exit(1 if failed else 0)
+
+    elif args.action == "graph":
+        logging.info("Building graph of Security Group references... ")
+        failed = []
+        describeGraph(runRegions(selectRegions(region), listRegionSecurityGroups, args.workers, onError=invalidateOnOptOut(profile), failed=failed))
+        sys.exit(1 if failed else 0)
+
+    elif args.action == "unused":
+        logging.info("Looking for unused Security Groups...")
+        writer.header()
+
+        failed = []
+        results = runRegions(selectRegions(region), unusedRegionSecurityGroups, args.workers, onError=invalidateOnOptOut(profile), failed=failed)
+        for region, records in groupby(results, key=itemgetter(0)):
+            describeSecurityGroups(region, (record for _, record in records))
+
+        writer.keep("Region", failed)
+        writer.close()
+        sys.exit(1 if failed else 0)
+
+    elif args.action == "sync":
+        logging.info("Synchronizing local inventory of security groups...")
+        if filters or recordFilter:
+            logging.error("Filters can not be used with sync, the local inventory keeps every resource.")
+            sys.exit(1)
+
+        inventory = openInventory()
+        synced = syncRegions(inventory, 'security_groups', selectRegions(region), listRegionSecurityGroups, args.max_age, args.workers, invalidateOnOptOut(profile))
+        logging.info("Refreshed %d regions: %s" %(len(synced), " ".join(synced)))
+        inventory.close()
         sys.exit(0)
 
 
 if __name__ == "__main__":
+    ## answered by the awsctl daemon when one is running
+    code = forward("ec2", "security-groups", sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
     main()
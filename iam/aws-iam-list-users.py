@@ -6,41 +6,86 @@
 # Dependencies: python3, boto3, Aws cli
 #
 
-import boto3
 from botocore.exceptions import ClientError
 import sys
 import argparse
 import logging
 import textwrap
-
-## add default logger config
-logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+import os
+
+## make the shared awsctl helpers importable when running the script directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from awsctl.clients import configureClients, getClient, DEFAULT_MAX_POOL_CONNECTIONS, RETRY_MODES, DEFAULT_RETRY_MODE, DEFAULT_MAX_ATTEMPTS
+from awsctl.metrics import enableMetrics
+from awsctl.daemon import forward
+from awsctl.fanout import fanOut, DEFAULT_ACCOUNT_WORKERS
+from awsctl.snapshot import DiffWriter
+from awsctl.records import IAMUser, fromResponses
+from awsctl.credentials import DEFAULT_ROLE_NAME
+from awsctl.pagination import paginate, DEFAULT_PAGE_SIZE
+from awsctl.output import RecordWriter, OUTPUT_FORMATS, DEFAULT_OUTPUT
+from awsctl.filters import projectFields
+from awsctl.inventory import Inventory, inventoryPath, syncRegions, DEFAULT_MAX_AGE, GLOBAL_REGION
+from awsctl.credreport import generateCredentialReport, credentialReportRows, auditUsers, AUDIT_COLUMNS, DEFAULT_MAX_KEY_AGE, DEFAULT_MAX_INACTIVE
 
 ## First create arguments to work with them
-argparser = argparse.ArgumentParser(description='Perform common instance tasks', formatter_class=argparse.RawDescriptionHelpFormatter, epilog=textwrap.dedent('''\
-    Additional information:
-        list    -> show list of existing users
-        details -> show details of selected user
-    '''))
-argparser.add_argument('action', help='Instance action to be performed list/details')
-argparser.add_argument('-p', '--profile', default="default", help='If no profile provided, assumes default')
-argparser.add_argument('-i', '--username', default="null", help='Name of Aws IAM User')
-
-try:
-    args = argparser.parse_args()
+def buildParser(prog=None):
+    argparser = argparse.ArgumentParser(prog=prog, description='Perform common instance tasks', formatter_class=argparse.RawDescriptionHelpFormatter, epilog=textwrap.dedent('''\
+        Additional information:
+            list    -> show list of existing users
+            details -> show details of selected user, or of every user with --all
+            sync    -> refresh the users of the local inventory
+            audit   -> report missing MFA, stale access keys and inactive users from the credential report
+        '''))
+    argparser.add_argument('action', help='Instance action to be performed list/details/sync/audit')
+    argparser.add_argument('-p', '--profile', default="default", help='If no profile provided, assumes default')
+    argparser.add_argument('-i', '--username', default="null", help='Name of Aws IAM User')
+    argparser.add_argument('-a', '--all', action='store_true', help='Show details of every IAM User with a few bulk calls, audit prints every user instead of only those with findings')
+    argparser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help='Number of records requested per API call')
+    argparser.add_argument('--max-pool-connections', type=int, default=DEFAULT_MAX_POOL_CONNECTIONS, help='Size of the HTTP connection pool of each Aws client')
+    argparser.add_argument('--retry-mode', choices=RETRY_MODES, default=DEFAULT_RETRY_MODE, help='Botocore retry mode, adaptive rate limits the calls when Aws throttles them')
+    argparser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='Maximum attempts of each Aws call, including retries')
+    argparser.add_argument('--metrics', nargs='?', const='-', help='Report latency, retries and throttling of Aws calls at exit, as a table on stderr or to a .json/.prom file')
+    argparser.add_argument('--profiles', help='Comma separated profiles, runs list/audit once per profile in parallel processes')
+    argparser.add_argument('--accounts', help='Comma separated account IDs, runs list/audit once per account assuming --role-name from --profile')
+    argparser.add_argument('--role-name', default=DEFAULT_ROLE_NAME, help='Role assumed in every account of --accounts, default is %s' %(DEFAULT_ROLE_NAME))
+    argparser.add_argument('--account-workers', type=int, default=DEFAULT_ACCOUNT_WORKERS, help='Number of profiles or accounts queried in parallel')
+    argparser.add_argument('--since', help='Snapshot file, print only the records added, modified or removed since it and update it')
+    argparser.add_argument('--fields', help='Comma separated columns printed by list/audit, default is all')
+    argparser.add_argument('-o', '--output', choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT, help='Output format of list/audit, default is tsv')
+    argparser.add_argument('--max-key-age', type=int, default=DEFAULT_MAX_KEY_AGE, help='Days after which audit reports an active access key as stale')
+    argparser.add_argument('--max-inactive', type=int, default=DEFAULT_MAX_INACTIVE, help='Days without activity after which audit reports a user as inactive')
+    argparser.add_argument('--from-cache', action='store_true', help='Answer list from the local inventory instead of calling Aws')
+    argparser.add_argument('--max-age', type=int, default=DEFAULT_MAX_AGE, help='Seconds after which sync refreshes the users of the local inventory')
+    argparser.add_argument('--inventory', help='Path of the local inventory database, default is one per profile in the cache directory')
+    return argparser
+
+
+## parse the command line, sys.argv when no argv is given
+def parseArguments(argv=None, prog=None):
+    try:
+        args = buildParser(prog).parse_args(argv)
+    except SystemExit as e:
+        ## -h exits with 0 once the help is printed
+        if not e.code:
+            raise
+        logging.error("Please run -h for help, Action is mandatory argument.")
+        sys.exit(1)
     logging.info("Performing action: %s" %(args.action))
     logging.info("Profile:           %s" %(args.profile))
     logging.info("User ID:           %s\n" %(args.username))
-except:
-    logging.error("Please run -h for help, Action is mandatory argument.")
-    sys.exit(1)
+    return args
+
+
+## set by main, the functions below read the command line from it
+args = None
 
 
 ## set iam client
 def setiamclient():
     try:
         global iamclient
-        iamclient = boto3.client('iam')
+        iamclient = getClient('iam')
         
     except ClientError as e:
         logging.error(e)
@@ -53,18 +98,18 @@ def checkUser(user):
         sys.exit(1)
 
 
-## Get info of all users
-def describeIAMUsers(users):
-    for user in users['Users']:
-        uid    = user.get("UserId")
-        uname  = user.get("UserName")
-        uarn   = user.get('Arn')
-        ucdate = user.get("CreateDate")
+## columns printed by describeIAMUsers
+COLUMNS = ("Name", "ID", "ARN", "Creation Date")
+## columns identifying a row across runs of --since
+KEY_COLUMNS = ("ID",)
+## the root account of audit has no ID
+AUDIT_KEY_COLUMNS = ("Name",)
 
-        try:
-            print("%s\t%s\t%s\t%s" %(uname, uid, uarn, ucdate))
-        except:
-            logging.error("Failed to get IAM Users information.")
+
+## Get info of all users, users is a stream of awsctl.records.IAMUser
+def describeIAMUsers(users):
+    for user in users:
+        writer.write(user.row())
 
 
 def describeIAMUser(user):
@@ -123,28 +168,140 @@ def describeIAMUserPolicies(user):
         print("\t%s=%s" %(pname, parn))
 
 
-def main():
+def describeIAMUserInlinePolicies(policies):
+    print("Inline Policies:")
+    for policy in policies:
+        print("\t%s" %(policy.get("PolicyName")))
+
+
+## Get details of every user from get_account_authorization_details. Groups are
+## loaded first so each user can be joined with them while users stream page by page.
+def describeAllIAMUsers():
+    groups = {}
+    for group in paginate(iamclient, 'get_account_authorization_details', 'GroupDetailList[]', args.page_size, Filter=['Group']):
+        groups[group.get("GroupName")] = group.get("Arn")
+
+    for user in paginate(iamclient, 'get_account_authorization_details', 'UserDetailList[]', args.page_size, Filter=['User']):
+        describeIAMUser({"User": user})
+        describeIAMGroups({"Groups": [{"GroupName": gname, "Arn": groups.get(gname)} for gname in user.get("GroupList", [])]})
+        describeIAMUserPolicies({"AttachedPolicies": user.get("AttachedManagedPolicies", [])})
+        describeIAMUserInlinePolicies(user.get("UserPolicyList", []))
+        print("")
+
+
+## Get all users of the account, region is ignored as IAM is global
+def listIAMUsers(region):
+    return paginate(iamclient, 'list_users', 'Users[]', args.page_size)
+
+
+## IAM user records, built as the pages arrive
+def iamUserRecords(region):
+    return fromResponses(IAMUser, region, listIAMUsers(region))
+
+
+## Audit every user from the credential report and list_users, two calls
+## whatever the number of users instead of several calls per user
+def auditIAMUsers():
+    users = dict((user.get("UserName"), user.get("UserId")) for user in listIAMUsers(GLOBAL_REGION))
+    generateCredentialReport(iamclient)
+    for row in auditUsers(credentialReportRows(iamclient), users, args.max_key_age, args.max_inactive):
+        if args.all or row[-1]:
+            writer.write(row)
+
+
+def openInventory():
+    return Inventory(args.inventory or inventoryPath(profile))
+
+
+## actions printing records, they can run across --profiles/--accounts and be diffed with --since
+LIST_ACTIONS = ('list', 'audit')
+
+
+def main(argv=None, prog=None):
 	## setting some global variables so that it can be reused
     global iamclient
+    global args
     global profile
+    global writer
 
+    logging.basicConfig(format='[%(levelname)s] %(message)s', level=logging.INFO)
+    args = parseArguments(argv, prog)
     profile = args.profile
 
     ## First set aws profile
-    boto3.setup_default_session(profile_name=profile)
+    if args.metrics:
+        enableMetrics(args.metrics)
+    configureClients(profile, args.max_pool_connections, retryMode=args.retry_mode, maxAttempts=args.max_attempts)
+
+    try:
+        columns = AUDIT_COLUMNS if args.action == "audit" else COLUMNS
+        writer = RecordWriter(columns, projectFields(columns, args.fields), args.output)
+        if args.since:
+            if args.action not in LIST_ACTIONS or args.profiles or args.accounts:
+                raise ValueError("--since can only be used by %s on a single profile" %("/".join(LIST_ACTIONS)))
+            writer = DiffWriter(writer, AUDIT_KEY_COLUMNS if columns is AUDIT_COLUMNS else KEY_COLUMNS, args.since)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    ## run the action once per profile or account in worker processes
+    if args.profiles or args.accounts:
+        sys.exit(fanOut(("iam", "users"), sys.argv[1:] if argv is None else argv, args, writer, LIST_ACTIONS))
+
+    ## answer from the local inventory without calling Aws
+    if args.from_cache:
+        if args.action != "list":
+            logging.error("Action %s can not be answered from the local inventory." %(args.action))
+            sys.exit(1)
+
+        inventory = openInventory()
+        writer.header()
+        describeIAMUsers(fromResponses(IAMUser, GLOBAL_REGION, (record for _, record in inventory.records('iam_users'))))
+        writer.close()
+        inventory.close()
+        sys.exit(0)
 
     setiamclient()
 
     if args.action == "list":
         logging.info("Listing IAM users...")
-        print("Name\tID\tARN\tCreation Date")
+        writer.header()
 
         try:
-            iamusers = iamclient.list_users()
+            describeIAMUsers(iamUserRecords(GLOBAL_REGION))
         except ClientError as e:
             logging.error(e)
+            ## the users not listed are not removed from a --since snapshot
+            writer.keep()
+            writer.close()
+            sys.exit(1)
 
-        describeIAMUsers(iamusers)
+        writer.close()
+        sys.exit(0)
+
+    elif args.action == "audit":
+        logging.info("Auditing IAM users from the credential report...")
+        writer.header()
+
+        try:
+            auditIAMUsers()
+        except (ClientError, TimeoutError) as e:
+            logging.error(e)
+            writer.keep()
+            writer.close()
+            sys.exit(1)
+
+        writer.close()
+        sys.exit(0)
+
+    elif args.action == "details" and args.all:
+        logging.info("Listing details of all IAM Users... ")
+
+        try:
+            describeAllIAMUsers()
+        except ClientError as e:
+            logging.error(e)
+            sys.exit(1)
 
         sys.exit(0)
 
@@ -156,15 +313,31 @@ def main():
             iamuser = iamclient.get_user(UserName=args.username)
             iampolicy = iamclient.list_attached_user_policies(UserName=args.username)
             iamgroups = iamclient.list_groups_for_user(UserName=args.username)
+            inlinePolicies = list(paginate(iamclient, 'list_user_policies', 'PolicyNames[]', args.page_size, UserName=args.username))
         except ClientError as e:
             logging.error(e)
+            sys.exit(1)
 
+        ## same sections as details --all
         describeIAMUser(iamuser)
         describeIAMGroups(iamgroups)
         describeIAMUserPolicies(iampolicy)
+        describeIAMUserInlinePolicies({"PolicyName": name} for name in inlinePolicies)
+
+        sys.exit(0)
 
+    elif args.action == "sync":
+        logging.info("Synchronizing local inventory of IAM users...")
+        inventory = openInventory()
+        synced = syncRegions(inventory, 'iam_users', [GLOBAL_REGION], listIAMUsers, args.max_age, 1)
+        logging.info("Refreshed %d regions: %s" %(len(synced), " ".join(synced)))
+        inventory.close()
         sys.exit(0)
 
 
 if __name__ == "__main__":
+    ## answered by the awsctl daemon when one is running
+    code = forward("iam", "users", sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
     main()